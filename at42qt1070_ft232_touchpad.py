@@ -29,15 +29,16 @@ In the patch, 'Wait On I/O High' MPSSE command (0x88) is used
 to detect the delayed signal.
 For that, 'D5 <-> SCL' connection is needed.
 '''
+import argparse
 import sys
 import os
 import time
 import select
 import logging
 os.environ["BLINKA_FT232H"]="1"
-import board
-from adafruit_bus_device import i2c_device
-from keysw_ft232 import InputBase_FT232
+from keysw_ft232 import InputBase_FT232, release_ftdi
+from at42qt1070_rawdetect import DeltaDetector, NKEYS, RAW_KEY_VALID_MIN, RAW_KEY_INVALID_MIN, \
+    CHIP_KEY_VALID_MIN, CHIP_KEY_INVALID_MIN
 
 logging.basicConfig(level=logging.INFO)
 logger=logging.getLogger('at42qt1070_ft232_touchpad')
@@ -45,36 +46,86 @@ logger.setLevel(logging.INFO)
 logging.getLogger('pyftdi.i2c').setLevel(logging.ERROR)
 
 class AT42QT1070_FT232(InputBase_FT232):
-    KEY_VALID_MIN=int(80E6) # 80msec
-    KEY_INVALID_MIN=int(80E6) # 80msec
+    KEY_VALID_MIN=CHIP_KEY_VALID_MIN
+    KEY_INVALID_MIN=CHIP_KEY_INVALID_MIN
     I2C_ADDRESS=0x1B
     AT42QT1070_CHIPID=0x2E
-    def probe_device(self) -> bool:
-        self.i2cdev = i2c_device.I2CDevice(board.I2C(), self.I2C_ADDRESS, probe=False)
+    def __init__(self, rawdetect: bool=False):
+        super().__init__()
+        self.recf=None
+        self.detector=None
+        if rawdetect:
+            # detect by the raw signals, not by the detect integrator of the chip
+            self.detector=DeltaDetector()
+            self.KEY_VALID_MIN=RAW_KEY_VALID_MIN
+            self.KEY_INVALID_MIN=RAW_KEY_INVALID_MIN
+
+    def open_bus(self) -> bool:
+        # hardware modules are imported only when the device is used
+        import board
+        from adafruit_bus_device import i2c_device
+        self.i2cbus = board.I2C()
+        self.i2cdev = i2c_device.I2CDevice(self.i2cbus, self.I2C_ADDRESS, probe=False)
         result = bytearray(1)
         self.i2cdev.write_then_readinto(bytes([0]), result)
         if result[0]!=self.AT42QT1070_CHIPID:
             logger.error("can't find AT42QT1070")
             return False
+        return True
+
+    def close_bus(self) -> None:
+        # busio.I2C.deinit drops the pyftdi I2cController without terminating it
+        controller=getattr(getattr(self.i2cbus, '_i2c', None), '_i2c', None)
+        try:
+            self.i2cbus.deinit()
+        except Exception:
+            pass
+        release_ftdi(controller)
+
+    def write_reg(self, reg: int, value: int) -> None:
+        # written registers are cached to restore them after reconnecting
+        self.i2cdev.write(bytes([reg, value]))
+        self.regcache[reg]=value
+
+    def probe_device(self) -> bool:
+        self.regcache = {}
+        if not self.open_bus(): return False
 
         if not self.__calibrate(): return False
         # remove low power mode, and set the shortest 8 msec interval
-        self.i2cdev.write(bytes([54, 0]))
-        self.i2cdev.write_then_readinto(bytes([54]), result)
-        if result[0]!=0:
-            logger.error("can't write to AT42QT1070")
-            return False
-        self.i2cdev.write(bytes([53, 0xf])) # no GUARD CHANNEL
+        self.write_reg(54, 0)
+        if not self.__check_lowpower(): return False
+        self.write_reg(53, 0xf) # no GUARD CHANNEL
         for i in range(5):
-            self.i2cdev.write(bytes([39+i, (16<<2)|0])) # AVE=8, ADK=0 for all keys
-            self.i2cdev.write(bytes([32+i, 100])) # Negative Threashold 30
-        self.i2cdev.write(bytes([39+5, 0])) # disable key5
-        self.i2cdev.write(bytes([39+6, 0])) # disable key6
+            self.write_reg(39+i, (16<<2)|0) # AVE=8, ADK=0 for all keys
+            self.write_reg(32+i, 100) # Negative Threashold 30
+        self.write_reg(39+5, 0) # disable key5
+        self.write_reg(39+6, 0) # disable key6
 
         logger.info("found AT42QT1070, initialization okay")
         self.scan_ts=time.time_ns()
         return True
 
+    def reconnect(self) -> bool:
+        # the chip calibrates itself at power on, and keeps the references
+        # while it is powered, only the cached registers are written
+        self.close_bus()
+        if not self.open_bus(): return False
+        for reg,value in self.regcache.items():
+            self.i2cdev.write(bytes([reg, value]))
+        if not self.__check_lowpower(): return False
+        if self.detector: self.detector=DeltaDetector()
+        self.reset_scan()
+        return True
+
+    def __check_lowpower(self) -> bool:
+        result = bytearray(1)
+        self.i2cdev.write_then_readinto(bytes([54]), result)
+        if result[0]!=0:
+            logger.error("can't write to AT42QT1070")
+            return False
+        return True
+
     def __calibrate(self) -> bool:
         result = bytearray(1)
         self.i2cdev.write(bytes([57, 1])) # start calibration
@@ -91,29 +142,48 @@ class AT42QT1070_FT232(InputBase_FT232):
         return True
 
     def key_status(self) -> int:
+        if self.detector or self.recf:
+            status,signals,refs=self.key_signals()
+            if self.recf:
+                self.recf.write("%d %d %s %s\n" % (self.scan_ts, status,
+                                                   ' '.join(map(str, signals)),
+                                                   ' '.join(map(str, refs))))
+            if self.detector: return self.detector.update(signals, refs)
+            return status
         result = bytearray(1)
         self.i2cdev.write_then_readinto(bytes([3]), result)
         logger.debug("key status=0x%x" % result[0])
         return result[0]
 
-    def __key_signal_ref(self, keyno: int) -> tuple[int, int]:
-        result = bytearray(1)
-        self.i2cdev.write_then_readinto(bytes([4+2*keyno]), result)
-        msb=result[0]
-        self.i2cdev.write_then_readinto(bytes([5+2*keyno]), result)
-        lsb=result[0]
-        signal=(msb<<8)|lsb
-        self.i2cdev.write_then_readinto(bytes([18+2*keyno]), result)
-        msb=result[0]
-        self.i2cdev.write_then_readinto(bytes([19+2*keyno]), result)
-        lsb=result[0]
-        ref=(msb<<8)|lsb
-        return (signal, ref)
+    def key_pending(self) -> bool:
+        return bool(self.detector) and self.detector.pending()
+
+    def key_signals(self) -> tuple[int, list[int], list[int]]:
+        # one burst read from the key status(3) to the reference of key4(27)
+        result = bytearray(25)
+        self.i2cdev.write_then_readinto(bytes([3]), result)
+        signals=[(result[1+2*i]<<8)|result[2+2*i] for i in range(NKEYS)]
+        refs=[(result[15+2*i]<<8)|result[16+2*i] for i in range(NKEYS)]
+        return (result[0], signals, refs)
+
 
+def parse_args():
+    pname=sys.argv[0]
+    i=pname.rfind('/')
+    if i>=0: pname=pname[i+1:]
+    opt_parser=argparse.ArgumentParser(prog=pname,
+                                       description="AT42QT1070 touchpad test")
+    opt_parser.add_argument("-d", "--rawdetect", action='store_true',
+                            help="detect by the raw signals")
+    opt_parser.add_argument("-r", "--record", nargs='?', default=None,
+                            help="record the raw signals for 'at42qt1070_rawdetect.py'")
+    return opt_parser.parse_args()
 
 if __name__ == "__main__":
-    tdev=AT42QT1070_FT232()
+    options=parse_args()
+    tdev=AT42QT1070_FT232(options.rawdetect)
     if not tdev.probe_device(): sys.exit(1)
+    if options.record: tdev.recf=open(options.record, "w")
     keys=0
     nkeys=0
     while True:
@@ -122,4 +192,5 @@ if __name__ == "__main__":
             print("{0:b}".format(pkey))
         if select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], []): break
 
+    if tdev.recf: tdev.recf.close()
     sys.exit(0)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Shiro Ninomiya
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/old-licenses/gpl-2.0.html>.
+#
+'''
+Touch detection from the raw signal and reference values of AT42QT1070.
+
+A touch makes the signal lower than the reference.  DeltaDetector keeps
+its own baseline for each key, and decides touch/release by an adaptive
+threshold with hysteresis.  It doesn't wait the detect integrator of the chip.
+
+The simulator replays signals recorded by
+'at42qt1070_ft232_touchpad.py -r FILE', and compares chords of the chip
+detection(the reference) and DeltaDetector, on the same scan_key logic.
+'''
+import argparse
+import sys
+from keysw_ft232 import InputBase_FT232
+
+NKEYS=5
+# debounce in scan_key for the detection of the chip
+CHIP_KEY_VALID_MIN=int(80E6) # 80msec
+CHIP_KEY_INVALID_MIN=int(80E6) # 80msec
+# debounce in scan_key for the raw detection, DeltaDetector has its own hysteresis
+RAW_KEY_VALID_MIN=int(30E6) # 30msec
+RAW_KEY_INVALID_MIN=int(30E6) # 30msec
+
+class DeltaDetector(object):
+    MIN_THRESHOLD=12 # minimum touch threshold in signal counts
+    NOISE_FACTOR=6.0 # touch threshold = NOISE_FACTOR * noise level
+    HYSTERESIS=0.5 # release threshold = HYSTERESIS * touch threshold
+    NOISE_RATE=1/64 # update rate of the noise level
+    DRIFT_RATE=1/256 # update rate of the baseline while not touched
+    ON_SAMPLES=2 # consecutive samples over the threshold to detect a touch
+    OFF_SAMPLES=2 # consecutive samples under the threshold to detect a release
+    def __init__(self):
+        self.baseline=[0.0]*NKEYS
+        self.noise=[0.0]*NKEYS
+        self.count=[0]*NKEYS
+        self.touched=0
+        self.started=False
+
+    def threshold(self, key: int) -> float:
+        return max(self.MIN_THRESHOLD, self.NOISE_FACTOR*self.noise[key])
+
+    def pending(self) -> bool:
+        # some key is going over or under the threshold, not decided yet
+        for c in self.count:
+            if c: return True
+        return False
+
+    def update(self, signals: list[int], refs: list[int]) -> int:
+        if not self.started:
+            # start from the reference of the chip
+            for i in range(NKEYS):
+                self.baseline[i]=float(refs[i])
+                self.noise[i]=self.MIN_THRESHOLD/self.NOISE_FACTOR
+            self.started=True
+        for i in range(NKEYS):
+            delta=self.baseline[i]-signals[i]
+            thr=self.threshold(i)
+            if self.touched&(1<<i):
+                if delta<thr*self.HYSTERESIS:
+                    self.count[i]+=1
+                    if self.count[i]>=self.OFF_SAMPLES:
+                        self.touched&=~(1<<i)
+                        self.count[i]=0
+                else:
+                    self.count[i]=0
+                continue
+            if delta>=thr:
+                self.count[i]+=1
+                if self.count[i]>=self.ON_SAMPLES:
+                    self.touched|=(1<<i)
+                    self.count[i]=0
+                continue
+            self.count[i]=0
+            # not touched, follow the drift and the noise
+            self.baseline[i]-=delta*self.DRIFT_RATE
+            self.noise[i]+=(abs(delta)-self.noise[i])*self.NOISE_RATE
+        return self.touched
+
+def read_record(recfile: str):
+    # a line is 'ts status signal0..signal4 ref0..ref4'
+    with open(recfile, "r") as inf:
+        for line in inf:
+            items=line.split()
+            if len(items)<2+2*NKEYS: continue
+            vals=[int(v) for v in items]
+            yield (vals[0], vals[1], vals[2:2+NKEYS], vals[2+NKEYS:2+2*NKEYS])
+
+class RecordedSignal_FT232(InputBase_FT232):
+    def __init__(self, raw: bool):
+        super().__init__()
+        self.raw=raw
+        self.vts=0
+        self.sample=None
+        self.detector=DeltaDetector()
+        if raw:
+            self.KEY_VALID_MIN=RAW_KEY_VALID_MIN
+            self.KEY_INVALID_MIN=RAW_KEY_INVALID_MIN
+        else:
+            # the same debounce as AT42QT1070_FT232
+            self.KEY_VALID_MIN=CHIP_KEY_VALID_MIN
+            self.KEY_INVALID_MIN=CHIP_KEY_INVALID_MIN
+
+    def now_ns(self) -> int:
+        return self.vts
+
+    def sleep_ns(self, nsec: int) -> None:
+        # every recorded sample is scanned
+        pass
+
+    def key_status(self) -> int:
+        ts,status,signals,refs=self.sample
+        if self.raw: return self.detector.update(signals, refs)
+        return status&0x1f
+
+    def key_pending(self) -> bool:
+        return self.raw and self.detector.pending()
+
+    def feed(self, sample: tuple) -> tuple[int, bool, bool]:
+        self.sample=sample
+        self.vts=sample[0]
+        return self.scan_key()
+
+def chord_events(samples: list[tuple], raw: bool) -> list[tuple[int, int]]:
+    # return (decided ts, bits) of non-repeat chords
+    tdev=RecordedSignal_FT232(raw)
+    events=[]
+    for sample in samples:
+        if not tdev.scan_ts: tdev.scan_ts=sample[0]
+        pkey,change,repeat=tdev.feed(sample)
+        if change and pkey and not repeat: events.append((tdev.scan_ts, pkey))
+    return events
+
+def compare(ref: list[tuple], test: list[tuple], window: int=int(300E6)) -> dict:
+    matched=0
+    wrong=0
+    gains=[]
+    ti=0
+    used=set()
+    for ts,bits in ref:
+        # the nearest test event in the window
+        best=None
+        for j in range(ti, len(test)):
+            if test[j][0]<ts-window:
+                ti=j+1
+                continue
+            if test[j][0]>ts+window: break
+            if j in used: continue
+            if best is None or abs(test[j][0]-ts)<abs(test[best][0]-ts): best=j
+        if best is None: continue
+        used.add(best)
+        if test[best][1]==bits:
+            matched+=1
+            gains.append(ts-test[best][0])
+        else:
+            wrong+=1
+    return {'ref':len(ref), 'test':len(test), 'matched':matched, 'wrong':wrong,
+            'extra':len(test)-len(used), 'gains':sorted(gains)}
+
+def parse_args():
+    pname=sys.argv[0]
+    i=pname.rfind('/')
+    if i>=0: pname=pname[i+1:]
+    opt_parser=argparse.ArgumentParser(prog=pname,
+                                       description="AT42QT1070 raw signal detection simulator")
+    opt_parser.add_argument("records", nargs='+',
+                            help="signal records by 'at42qt1070_ft232_touchpad.py -r'")
+    opt_parser.add_argument("-n", "--noise", nargs='?', default=DeltaDetector.NOISE_FACTOR,
+                            type=float, help="threshold factor to the noise level")
+    opt_parser.add_argument("-m", "--minthr", nargs='?', default=DeltaDetector.MIN_THRESHOLD,
+                            type=int, help="minimum threshold in signal counts")
+    opt_parser.add_argument("-y", "--hysteresis", nargs='?', default=DeltaDetector.HYSTERESIS,
+                            type=float, help="release threshold ratio to the touch threshold")
+    return opt_parser.parse_args()
+
+if __name__ == "__main__":
+    options=parse_args()
+    DeltaDetector.NOISE_FACTOR=options.noise
+    DeltaDetector.MIN_THRESHOLD=options.minthr
+    DeltaDetector.HYSTERESIS=options.hysteresis
+    for recfile in options.records:
+        samples=list(read_record(recfile))
+        res=compare(chord_events(samples, False), chord_events(samples, True))
+        gains=res['gains']
+        print("%s: chip chords:%d, raw chords:%d, matched:%d, wrong:%d, extra:%d" %
+              (recfile, res['ref'], res['test'], res['matched'], res['wrong'], res['extra']))
+        if gains:
+            print("  earlier than chip(msec) mean:%.1f, median:%.1f, min:%.1f, max:%.1f" %
+                  (sum(gains)/len(gains)/1E6, gains[len(gains)//2]/1E6,
+                   gains[0]/1E6, gains[-1]/1E6))
+    sys.exit(0)
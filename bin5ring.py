@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Shiro Ninomiya
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/old-licenses/gpl-2.0.html>.
+#
+'''
+Shared memory ring buffer of decoded chord events.
+
+'uhidbin5.py -e /dev/shm/bin5events' publishes every chord event to the ring,
+and other processes read the live stream with EventRingReader.
+
+header: magic(4s), version(I), nrecords(I), record size(I), head(Q)
+  'head' is the number of records written so far.
+record: seq(Q), ts(q), latency(q), bits(B), dcode(B), modifiers(5s),
+        table(8s), report(8s)
+  'seq' is 2*n+1 while the n-th record is being written, and 2*n+2 after that.
+  A reader copies a record, and takes it only when 'seq' is the same
+  even number before and after the copy.
+
+There is only one writer, and no lock is used.
+A restarted writer continues on the existing ring when its layout matches.
+Otherwise it makes a new file instead of truncating the file,
+so a reader which maps the old file never gets SIGBUS.  The reader
+follows the new file when the path is replaced.
+'''
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+MAGIC=b'B5RG'
+VERSION=1
+HEADER_FORMAT='<4sIIIQ'
+HEADER_SIZE=64
+HEAD_OFFSET=16
+RECORD_FORMAT='<QqqBB5s8s8sx'
+RECORD_SIZE=struct.calcsize(RECORD_FORMAT)
+MODIFIER_KEYS=('M1','M2','M3','M4','M5')
+TABLE_NAME_SIZE=8 # the table name is ascii in 8 bytes, CodeTable checks it
+
+ChordEvent=namedtuple('ChordEvent',
+                      ['ts', 'latency', 'bits', 'dcode', 'modifiers', 'table', 'report'])
+
+def ring_header(fd: int) -> tuple:
+    # the header of a ring file, None if it isn't a ring of this version
+    size=struct.calcsize(HEADER_FORMAT)
+    data=os.pread(fd, size, 0)
+    if len(data)<size: return None
+    hdr=struct.unpack(HEADER_FORMAT, data)
+    if hdr[0]!=MAGIC or hdr[1]!=VERSION or hdr[3]!=RECORD_SIZE: return None
+    return hdr
+
+def unpack_event(rec: tuple) -> ChordEvent:
+    return ChordEvent(rec[1], rec[2], rec[3], rec[4],
+                      dict(zip(MODIFIER_KEYS, rec[5])),
+                      rec[6].rstrip(b'\0').decode(errors='replace'), tuple(rec[7]))
+
+class EventRingWriter(object):
+    def __init__(self, path: str="/dev/shm/bin5events", nrecords: int=1024):
+        self.nrecords=nrecords
+        size=HEADER_SIZE+nrecords*RECORD_SIZE
+        fd=os.open(path, os.O_RDWR|os.O_CREAT, 0o644)
+        hdr=ring_header(fd)
+        fsize=os.fstat(fd).st_size
+        if hdr and hdr[2]==nrecords and fsize==size:
+            # continue on the existing ring, readers keep their position
+            self.head=hdr[4]
+        else:
+            if fsize:
+                # readers may map the old file, don't truncate it
+                os.close(fd)
+                os.unlink(path)
+                fd=os.open(path, os.O_RDWR|os.O_CREAT|os.O_EXCL, 0o644)
+            os.ftruncate(fd, size)
+            self.head=0
+        self.mm=mmap.mmap(fd, size)
+        os.close(fd)
+        struct.pack_into(HEADER_FORMAT, self.mm, 0, MAGIC, VERSION,
+                         nrecords, RECORD_SIZE, self.head)
+        self.mbytes=bytearray(5)
+        # encoded table names and reports, not to allocate them on every chord
+        self.tnames={}
+        self.reports={}
+
+    def publish(self, ts: int, latency: int, bits: int, dcode: int, table: str,
+                modifiers: dict[str, int], report: tuple[int, ...]) -> None:
+        for i,k in enumerate(MODIFIER_KEYS):
+            self.mbytes[i]=modifiers[k] if modifiers else 0
+        tname=self.tnames.get(table)
+        if tname is None:
+            tname=table.encode()[:TABLE_NAME_SIZE]
+            self.tnames[table]=tname
+        rbytes=self.reports.get(report)
+        if rbytes is None:
+            rbytes=bytes(report)
+            self.reports[report]=rbytes
+        offset=HEADER_SIZE+(self.head%self.nrecords)*RECORD_SIZE
+        struct.pack_into('<Q', self.mm, offset, 2*self.head+1)
+        struct.pack_into(RECORD_FORMAT, self.mm, offset, 2*self.head+1, ts, latency,
+                         bits, dcode, self.mbytes, tname, rbytes)
+        struct.pack_into('<Q', self.mm, offset, 2*self.head+2)
+        self.head+=1
+        struct.pack_into('<Q', self.mm, HEAD_OFFSET, self.head)
+
+    def close(self) -> None:
+        self.mm.close()
+
+class EventRingReader(object):
+    def __init__(self, path: str="/dev/shm/bin5events", from_start: bool=False):
+        self.path=path
+        self.lost=0
+        self.open(from_start)
+
+    def open(self, from_start: bool) -> None:
+        fd=os.open(self.path, os.O_RDONLY)
+        try:
+            hdr=ring_header(fd)
+            if not hdr: raise ValueError("%s is not a bin5 event ring" % self.path)
+            ino=os.fstat(fd).st_ino
+            self.mm=mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self.ino=ino
+        self.nrecords,head=hdr[2],hdr[4]
+        self.tail=max(head-self.nrecords, 0) if from_start else head
+
+    def replaced(self) -> bool:
+        # True when the writer has made a new file on the path
+        try:
+            return os.stat(self.path).st_ino!=self.ino
+        except FileNotFoundError:
+            return False
+
+    def head(self) -> int:
+        return struct.unpack_from('<Q', self.mm, HEAD_OFFSET)[0]
+
+    def read_raw(self) -> list[tuple]:
+        # return new records as unpacked tuples
+        res=[]
+        head=self.head()
+        if head<self.tail:
+            # the ring is restarted from the beginning, follow the new head
+            self.tail=head
+        while self.tail<head:
+            if head-self.tail>self.nrecords:
+                # the writer has overwritten unread records
+                self.lost+=head-self.tail-self.nrecords
+                self.tail=head-self.nrecords
+            offset=HEADER_SIZE+(self.tail%self.nrecords)*RECORD_SIZE
+            rec=struct.unpack_from(RECORD_FORMAT, self.mm, offset)
+            seq=struct.unpack_from('<Q', self.mm, offset)[0]
+            if rec[0]!=seq or seq!=2*self.tail+2:
+                # overwritten while copying, read the head again
+                head=self.head()
+                if head-self.tail<=self.nrecords: break
+                continue
+            res.append(rec)
+            self.tail+=1
+        return res
+
+    def read(self) -> list[ChordEvent]:
+        return [unpack_event(rec) for rec in self.read_raw()]
+
+    def follow(self, interval: float=0.01):
+        while True:
+            recs=self.read_raw()
+            if not recs:
+                if self.replaced():
+                    # a restarted writer made a new ring, read it from the start
+                    mm=self.mm
+                    try:
+                        self.open(True)
+                        mm.close()
+                        continue
+                    except (OSError, ValueError):
+                        # not initialized yet, try again
+                        pass
+                time.sleep(interval)
+                continue
+            for rec in recs:
+                yield rec
+
+    def close(self) -> None:
+        self.mm.close()
+
+def read_log(logfile: str, chunk: int=4096):
+    # read a log file written by the sample consumer, record by record
+    with open(logfile, "rb") as inf:
+        while True:
+            data=inf.read(chunk*RECORD_SIZE)
+            if not data: break
+            if len(data)%RECORD_SIZE:
+                data=data[:len(data)-len(data)%RECORD_SIZE]
+            for rec in struct.iter_unpack(RECORD_FORMAT, data):
+                yield rec
+
+def parse_args():
+    pname=sys.argv[0]
+    i=pname.rfind('/')
+    if i>=0: pname=pname[i+1:]
+    opt_parser=argparse.ArgumentParser(prog=pname,
+                                       description="binary5 keyboard event ring consumer")
+    opt_parser.add_argument("-e", "--events", nargs='?', default="/dev/shm/bin5events",
+                            help="event ring file")
+    opt_parser.add_argument("-o", "--output", nargs='?', default=None,
+                            help="append raw records to this log file")
+    opt_parser.add_argument("-q", "--quiet", action='store_true',
+                            help="don't print events")
+    return opt_parser.parse_args()
+
+if __name__ == "__main__":
+    options=parse_args()
+    reader=EventRingReader(options.events)
+    outf=open(options.output, "ab") if options.output else None
+    try:
+        for rec in reader.follow():
+            if outf:
+                outf.write(struct.pack(RECORD_FORMAT, *rec))
+                outf.flush()
+            if options.quiet: continue
+            ev=unpack_event(rec)
+            print("%d.%06d [%s] %s dcode=%2d latency=%6.1fmsec mod=%s report=%s" %
+                  (ev.ts//1000000000, ev.ts%1000000000//1000, ev.table,
+                   "{0:07b}".format(ev.bits), ev.dcode, ev.latency/1E6,
+                   ''.join(str(v) for v in ev.modifiers.values()),
+                   ' '.join("%02x" % v for v in ev.report)))
+    except KeyboardInterrupt:
+        pass
+    if reader.lost: print("lost %d events" % reader.lost)
+    if outf: outf.close()
+    reader.close()
+    sys.exit(0)
@@ -26,20 +26,106 @@ import logging
 import random
 import select
 import termios
+from collections import deque
+from typing import Iterator
 from at42qt1070_ft232_touchpad import AT42QT1070_FT232
-from keysw_ft232 import CodeTable, KeySw_FT232
+from keysw_ft232 import CodeTable, InputBase_FT232, KeySw_FT232
 
 FONTFILE="/usr/share/fonts/opentype/freefont/FreeSans.otf"
 
 logger=logging.getLogger('bkbpractice')
 logger.setLevel(logging.INFO)
 
-def check_keyin():
-    dp=select.poll()
-    dp.register(sys.stdin, select.POLLIN)
-    pres=dp.poll(0.0)
-    if not pres: return False
-    return True
+class KeyinPoller(object):
+    def __init__(self):
+        self.poller=select.poll()
+        self.poller.register(sys.stdin, select.POLLIN)
+
+    def wait(self, timeout: float=0.0) -> bool:
+        # wait 'timeout' msec, return True when stdin has input
+        return bool(self.poller.poll(timeout))
+
+class PracticeStats(object):
+    WPM_WINDOW=25 # the rolling WPM is calculated by the last 25 characters
+    def __init__(self):
+        self.start_ts=0
+        self.last_ts=0
+        self.total=0
+        self.correct=0
+        self.latencies: list[int] = []
+        self.charlat: dict[str, list[int]] = {}
+        self.window=deque(maxlen=self.WPM_WINDOW+1)
+
+    def start(self, ts: int) -> None:
+        # a new word is shown at 'ts'
+        if not self.start_ts: self.start_ts=ts
+        self.last_ts=ts
+        if not self.window: self.window.append(ts)
+
+    def add(self, ts: int, target: str, ik: str) -> None:
+        lat=ts-self.last_ts
+        self.last_ts=ts
+        self.total+=1
+        if ik==target: self.correct+=1
+        self.latencies.append(lat)
+        cl=self.charlat.setdefault(target, [0, 0])
+        cl[0]+=lat
+        cl[1]+=1
+        self.window.append(ts)
+
+    def wpm(self) -> float:
+        if len(self.window)<2 or self.window[-1]==self.window[0]: return 0.0
+        return (len(self.window)-1)/5/((self.window[-1]-self.window[0])/60E9)
+
+    def accuracy(self) -> float:
+        if not self.total: return 0.0
+        return self.correct*100/self.total
+
+    def status(self) -> str:
+        lat=self.latencies[-1]/1E6 if self.latencies else 0
+        return "wpm:%5.1f acc:%5.1f%% lat:%4dms" % (self.wpm(), self.accuracy(), lat)
+
+    def summary(self) -> str:
+        if not self.total: return "no input"
+        lats=sorted(self.latencies)
+        dts=self.last_ts-self.start_ts
+        res="%d chars, wpm:%.1f, accuracy:%.1f%%\n" % \
+            (self.total, self.total/5/(dts/60E9) if dts else 0.0, self.accuracy())
+        res+="latency(msec) mean:%.0f, median:%.0f, p90:%.0f\n" % \
+            (sum(lats)/len(lats)/1E6, lats[len(lats)//2]/1E6, lats[len(lats)*9//10]/1E6)
+        slow=sorted(self.charlat.items(), key=lambda x: x[1][0]/x[1][1], reverse=True)
+        res+="slowest: "+", ".join("%s:%.0f" % (repr(k), v[0]/v[1]/1E6) for k,v in slow[:5])
+        return res
+
+class TraceRecorder(object):
+    '''
+    record the prompts and the key status changes of a practice session,
+    'bkbreplay.py' replays it.
+      T <mode> <wordlen> <gap> <interval>
+      W <ts> <prompt word, unicode_escape encoded>
+      K <ts> <key bits>
+    '''
+    def __init__(self, tracefile: str, tdev: InputBase_FT232, mode: int,
+                 wordlen: int, gap: float, interval: float):
+        self.outf=open(tracefile, "w")
+        self.tdev=tdev
+        self.last_keys=-1
+        self.outf.write("T %d %d %f %f\n" % (mode, wordlen, gap, interval))
+        self.key_status=tdev.key_status
+        tdev.key_status=self.record_key_status
+
+    def record_key_status(self) -> int:
+        keys=self.key_status()
+        if keys!=self.last_keys:
+            self.outf.write("K %d %d\n" % (self.tdev.scan_ts, keys))
+            self.last_keys=keys
+        return keys
+
+    def prompt(self, ts: int, word: str) -> None:
+        self.outf.write("W %d %s\n" % (ts, word.encode('unicode_escape').decode('ascii')))
+
+    def close(self) -> None:
+        self.outf.close()
 
 class PraCodeTable(CodeTable):
     SPECIAL_KEYS = {'BS':'\b', 'SP':' ', 'VBAR':'|', 'TAB':'\t', 'ESC':'\x1B', 'RET':'\n',
@@ -53,20 +139,12 @@ class PraCodeTable(CodeTable):
         return key[0]
 
     def key2code(self, kchr:str) -> int:
-        for i, keydef in enumerate(self.keytables[self.csel]):
-            if keydef==None: continue
-            if keydef['key'] == kchr:
-                return i
+        kt=self.chrmap.get(kchr)
+        if kt and kt[0]==0: return kt[1]
         return 0
 
     def chr2code(self, kchr:str) -> tuple[int, int]:
-        for i, keydef in enumerate(self.keytables[self.csel]):
-            if keydef==None: continue
-            for j in ('key','M1','M2','M3','M4','M5'):
-                if keydef[j] == kchr:
-                    if j=='key': return (0, i)
-                    return (self.key2code(j), i)
-        return (0, 0)
+        return self.chrmap.get(kchr, (0, 0))
 
 class FingersImage(object):
     def __init__(self):
@@ -104,18 +182,40 @@ class FingersImage(object):
         image.save(self.showfile)
         image.close()
 
+    def createheatmap(self, weights: list[float], text: str, outfile: str) -> None:
+        # paint each finger in red, the density is weights[finger](0.0 to 1.0)
+        image = Image.open("fingersb.png").convert("RGBA")
+        for i in range(5):
+            img = Image.open("fingers%d.png" % i).convert("RGBA")
+            w = min(max(weights[i], 0.0), 1.0)
+            mask = img.getchannel('A').point(lambda a: int(a*w))
+            image.paste(Image.new("RGBA", img.size, (255,0,0,255)), (0,0), mask=mask)
+            img.close()
+        d=ImageDraw.Draw(image)
+        d.text((180,360), text, font=self.font)
+        image.save(outfile)
+        image.close()
+
     def close(self):
         self.closeimg()
         self.showfile=None
 
 class PracticeOneKey(object):
+    # random words have this length when the length is not limited
+    DEFAULT_WORDLEN=4
     def __init__(self, ktype:str, codetable: PraCodeTable,
-                 fimage: FingersImage=None, pstr: str=""):
+                 fimage: FingersImage=None, pstr: str="", tdev: InputBase_FT232=None):
         super().__init__()
         self.codetable=codetable
         self.fimage=fimage
         self.setpstr(pstr)
-        if ktype=='touchpad':
+        self.keyin=KeyinPoller()
+        self.prompts=None
+        self.trace=None
+        self.stats=PracticeStats()
+        if tdev:
+            self.tdev=tdev
+        elif ktype=='touchpad':
             self.tdev=AT42QT1070_FT232()
         else:
             self.tdev=KeySw_FT232()
@@ -138,7 +238,24 @@ class PracticeOneKey(object):
         else:
             self.pstr=pstr
 
+    def now_ns(self) -> int:
+        return self.tdev.now_ns() if self.tdev else time.time_ns()
+
+    def sleep(self, sec: float) -> None:
+        if self.tdev:
+            self.tdev.sleep_ns(int(sec*1E9))
+        else:
+            time.sleep(sec)
+
+    def prompt(self, word: str) -> None:
+        self.stats.start(self.now_ns())
+        if self.trace: self.trace.prompt(self.now_ns(), word)
+
     def nextchar(self) -> str:
+        if self.prompts:
+            # prompts of a recorded trace
+            for k in self.prompts: yield k
+            return
         plen=len(self.pstr)
         while True:
             i=random.randint(0, plen-1)
@@ -149,61 +266,88 @@ class PracticeOneKey(object):
         self.modifier: tuple[str, int] = ('', 0)
         for k in self.nextchar():
             kt=self.codetable.chr2code(k)
-            self.fimage.createimg(0, k)
+            if self.fimage: self.fimage.createimg(0, k)
+            self.prompt(k)
             if self.tdev:
                 while True:
+                    if self.keyin.wait(self.tdev.scan_delay()/1E6): return
                     pkey,change,repeat=self.tdev.scan_key()
                     if not change: continue
                     if pkey==0: continue
                     ik=self.codetable.code2charWm(pkey)
-                    if check_keyin(): return
                     if ik!='': break
+                self.stats.add(self.tdev.scan_ts, k, ik)
                 if ik==k: continue
-                self.fimage.createimg(0, ik, red=True)
-            time.sleep(gap)
+                if self.fimage: self.fimage.createimg(0, ik, red=True)
+            self.sleep(gap)
             if kt[0]==0:
-                self.fimage.createimg(kt[1], k)
+                if self.fimage: self.fimage.createimg(kt[1], k)
             else:
-                self.fimage.createimg(kt[0], "")
-                time.sleep(gap)
-                self.fimage.createimg(kt[1], "")
-            time.sleep(interval)
+                if self.fimage: self.fimage.createimg(kt[0], "")
+                self.sleep(gap)
+                if self.fimage: self.fimage.createimg(kt[1], "")
+            self.sleep(interval)
             count+=1
             if trytimes==count: break
-            if check_keyin(): return
+            if self.keyin.wait(): return
 
-    def tplay(self, trytimes:int=0) -> None:
-        ccode={'red':'\033[91m', 'green':'\033[92m', 'yellow':'\033[93m',
-                'blue':'\033[94m', 'purple':'\033[95m', 'cyan':'\033[96m',
-                'gray':'\033[97m', 'black':'\033[98m',
-                'end':'\033[0m', 'bold':'\033[1m', 'underline':'\033[4m'}
-        wordlen=4
-        count=0
+    def nextword(self, wordlen: int, corpus: list[str]=None) -> Iterator[str]:
+        if self.prompts:
+            for word in self.prompts: yield word
+            return
+        if corpus:
+            words=[w for w in corpus if (wordlen==0 or len(w)<=wordlen) and
+                   all(c in self.pstr for c in w)]
+            if words:
+                while True:
+                    yield random.choice(words)
+            logger.warning("no word in the corpus fits, use random characters")
+        if wordlen<1: wordlen=self.DEFAULT_WORDLEN
         while True:
             word=''
             for k in self.nextchar():
                 word+=k
                 if len(word)==wordlen: break
-            print(word)
+            yield word
+
+    def tplay(self, trytimes:int=0, wordlen:int=4, corpus:list[str]=None) -> None:
+        ccode={'red':'\033[91m', 'green':'\033[92m', 'yellow':'\033[93m',
+                'blue':'\033[94m', 'purple':'\033[95m', 'cyan':'\033[96m',
+                'gray':'\033[97m', 'black':'\033[98m',
+                'end':'\033[0m', 'bold':'\033[1m', 'underline':'\033[4m'}
+        stats=self.stats
+        count=0
+        for word in self.nextword(wordlen, corpus):
+            sys.stdout.write(word+'\n')
+            sys.stdout.flush()
+            self.prompt(word)
+            statcol=max(wordlen, len(word))+4
             wc=0
-            while wc<wordlen:
-                while True:
-                    pkey,change,repeat=self.tdev.scan_key()
-                    if pkey==0: continue
-                    if change: break
+            while wc<len(word):
+                # sleep in poll until the next scan, or until stdin has input
+                if self.keyin.wait(self.tdev.scan_delay()/1E6):
+                    print()
+                    print(stats.summary())
+                    return
+                pkey,change,repeat=self.tdev.scan_key()
+                if pkey==0 or not change: continue
                 ik=self.codetable.code2charWm(pkey)
-                if ik:
-                    if ik!=word[wc]:
-                        print(("%s{}%s" % (ccode['red'], ccode['end'])) .format(ik), end='')
-                    else:
-                        print(ik, end='')
-                    sys.stdout.flush()
-                    wc+=1
-                if check_keyin(): return
-            print()
-            print("----------")
+                if not ik: continue
+                stats.add(self.tdev.scan_ts, word[wc], ik)
+                if ik!=word[wc]:
+                    ik=("%s{}%s" % (ccode['red'], ccode['end'])).format(ik)
+                # write the typed character, and update the status at the right side
+                sys.stdout.write("%s\0337\033[%dG\033[K%s\0338" % (ik, statcol, stats.status()))
+                sys.stdout.flush()
+                wc+=1
+            sys.stdout.write('\n')
             count+=1
             if trytimes==count: break
+        print(stats.summary())
+
+def read_corpus(corpusfile: str) -> list[str]:
+    with open(corpusfile, "r") as inf:
+        return inf.read().split()
 
 def parse_args():
     pname=sys.argv[0]
@@ -222,6 +366,12 @@ def parse_args():
                             help="times of repeating practice")
     opt_parser.add_argument("-m", "--mode", nargs='?', default=0, type=int,
                             help="practice mode, 0:graphics(default), 1:text")
+    opt_parser.add_argument("-w", "--wordlen", nargs='?', default=4, type=int,
+                            help="word length in text mode, max length with a corpus(0:no limit with a corpus)")
+    opt_parser.add_argument("-c", "--corpus", nargs='?', default=None,
+                            help="text file of practice words in text mode")
+    opt_parser.add_argument("-r", "--record", nargs='?', default=None,
+                            help="record the session to a trace file for 'bkbreplay.py'")
     opt_parser.add_argument("-k", "--ktype", nargs='?', default="keysw",
                             help="keytype 'keysw' or 'touchpad'")
     return opt_parser.parse_args()
@@ -255,11 +405,20 @@ if __name__ == "__main__":
         fimage.createimg(0, "")
         fimage.showimg()
         pkey=PracticeOneKey(options.ktype, codetable, fimage, pstr=options.string)
+        if options.record and pkey.tdev:
+            pkey.trace=TraceRecorder(options.record, pkey.tdev, options.mode,
+                                     options.wordlen, options.gap, options.interval)
         pkey.play(options.times, gap=options.gap, interval=options.interval)
         fimage.close()
+        print(pkey.stats.summary())
     else:
         pkey=PracticeOneKey(options.ktype, codetable, pstr=options.string)
-        pkey.tplay()
+        if options.record and pkey.tdev:
+            pkey.trace=TraceRecorder(options.record, pkey.tdev, options.mode,
+                                     options.wordlen, options.gap, options.interval)
+        corpus=read_corpus(options.corpus) if options.corpus else None
+        pkey.tplay(options.times, options.wordlen, corpus)
+    if pkey.trace: pkey.trace.close()
 
     ckeyin.close()
     sys.exit(0)
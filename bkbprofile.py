@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Shiro Ninomiya
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/old-licenses/gpl-2.0.html>.
+#
+'''
+Chord usage profiler.
+
+It reads chord events from the log files written by 'bin5ring.py -o',
+or from the live event ring, and aggregates them by table, modifier and chord.
+All counters are fixed size arrays, the memory usage doesn't depend on
+the length of the logs.
+
+chord index: 1-31 is dcode, 32 is the BS thumb key, 33 is the SP thumb key.
+'''
+import argparse
+import sys
+import logging
+from array import array
+from bin5ring import EventRingReader, read_log, MODIFIER_KEYS
+from keysw_ft232 import CodeTable
+
+logger=logging.getLogger('bkbprofile')
+logger.setLevel(logging.INFO)
+
+NCHORDS=34
+CHORD_BS=32
+CHORD_SP=33
+NMODS=len(MODIFIER_KEYS)+1 # no modifier + M1..M5
+NBITS=6 # number of fingers in a chord, 0..5
+HID_BS=0x2a # the usage id of Backspace in the report
+
+def chord_index(bits: int) -> int:
+    if bits&0x20: return CHORD_BS
+    if bits&0x40: return CHORD_SP
+    return bits&0x1f
+
+def chord_fingers(chord: int) -> int:
+    # the thumb is the 1st finger(bit0)
+    if chord>=CHORD_BS: return 1
+    return chord
+
+def mod_index(modifiers: bytes) -> int:
+    # the first active modifier, 0 when no modifier is active
+    for i,v in enumerate(modifiers):
+        if v: return i+1
+    return 0
+
+class ChordProfile(object):
+    # a gap longer than this is a pause, not typing time
+    PAUSE_GAP=int(2E9) # 2sec
+    def __init__(self):
+        self.tables: dict[str, int] = {}
+        self.counts: list[array] = []
+        self.latsum: list[array] = []
+        self.errors: list[array] = []
+        self.trcount=array('q', bytes(8*NCHORDS*NCHORDS))
+        self.trsum=array('q', bytes(8*NCHORDS*NCHORDS))
+        # transition cost by the number of fingers which change the state
+        self.fmcount=array('q', bytes(8*6))
+        self.fmsum=array('q', bytes(8*6))
+        # by the number of fingers in the chord
+        self.bccount=array('q', bytes(8*NBITS))
+        self.bclat=array('q', bytes(8*NBITS))
+        self.bcerrors=array('q', bytes(8*NBITS))
+        self.last_chord=0
+        self.last_ts=0
+        self.last_cell=None
+        self.nevents=0
+
+    def table_index(self, table: str) -> int:
+        ti=self.tables.get(table)
+        if ti is None:
+            ti=len(self.tables)
+            self.tables[table]=ti
+            for ar in (self.counts, self.latsum, self.errors):
+                ar.append(array('q', bytes(8*NMODS*NCHORDS)))
+        return ti
+
+    def add(self, rec: tuple) -> None:
+        # 'rec' is a raw record of bin5ring
+        ts,latency,bits,modifiers,table,report=rec[1],rec[2],rec[3],rec[5],rec[6],rec[7]
+        chord=chord_index(bits)
+        if chord==0: return
+        ti=self.table_index(table.rstrip(b'\0').decode(errors='replace'))
+        cell=mod_index(modifiers)*NCHORDS+chord
+        bc=chord_fingers(chord).bit_count()
+        self.counts[ti][cell]+=1
+        self.latsum[ti][cell]+=latency
+        self.bccount[bc]+=1
+        self.bclat[bc]+=latency
+        # BS is the thumb key, or a chord like M2+s on the touchpad
+        erase=report[2]==HID_BS
+        if erase and self.last_cell:
+            # the previous chord is erased, count it as an error
+            self.errors[self.last_cell[0]][self.last_cell[1]]+=1
+            self.bcerrors[self.last_cell[2]]+=1
+        if self.last_chord and 0<ts-self.last_ts<self.PAUSE_GAP:
+            dts=ts-self.last_ts
+            tri=self.last_chord*NCHORDS+chord
+            self.trcount[tri]+=1
+            self.trsum[tri]+=dts
+            fm=(chord_fingers(self.last_chord)^chord_fingers(chord)).bit_count()
+            self.fmcount[fm]+=1
+            self.fmsum[fm]+=dts
+        self.last_chord=chord
+        self.last_ts=ts
+        if erase:
+            self.last_cell=None
+        elif report[2]:
+            # a modifier chord sends nothing, and isn't erased by BS
+            self.last_cell=(ti,cell,bc)
+        self.nevents+=1
+
+    def chord_cost(self, chord: int) -> tuple[int, int]:
+        # (number of transitions to 'chord', sum of the transition time)
+        n=0
+        t=0
+        for prev in range(NCHORDS):
+            n+=self.trcount[prev*NCHORDS+chord]
+            t+=self.trsum[prev*NCHORDS+chord]
+        return (n, t)
+
+    def finger_weights(self) -> tuple[list[float], list[float]]:
+        # per finger (usage frequency, typing time), normalized to 1.0
+        freq=[0]*5
+        cost=[0]*5
+        for chord in range(1, NCHORDS):
+            f=chord_fingers(chord)
+            n=sum(counts[m*NCHORDS+chord] for counts in self.counts for m in range(NMODS))
+            t=self.chord_cost(chord)[1]
+            for i in range(5):
+                if f&(1<<i):
+                    freq[i]+=n
+                    cost[i]+=t
+        return ([v/max(freq) if max(freq) else 0.0 for v in freq],
+                [v/max(cost) if max(cost) else 0.0 for v in cost])
+
+    def chord_name(self, codetable: CodeTable, table: str, mi: int, chord: int) -> str:
+        if chord==CHORD_BS: return 'BS'
+        if chord==CHORD_SP: return 'SP'
+        if not codetable or table not in codetable.keytables: return ''
+        keydef=codetable.keytables[table][chord]
+        if not keydef: return ''
+        if mi==0: return keydef['key']
+        return keydef[MODIFIER_KEYS[mi-1]] or keydef['key']
+
+    def print_report(self, codetable: CodeTable=None, topn: int=20) -> None:
+        print("%d events" % self.nevents)
+        rows=[]
+        for table,ti in self.tables.items():
+            for cell in range(NMODS*NCHORDS):
+                n=self.counts[ti][cell]
+                if not n: continue
+                mi,chord=divmod(cell, NCHORDS)
+                ntr,ttr=self.chord_cost(chord)
+                mean_tr=ttr/ntr if ntr else 0
+                rows.append((n*mean_tr, table, mi, chord, n,
+                             self.latsum[ti][cell]/n, self.errors[ti][cell]/n, mean_tr))
+        rows.sort(reverse=True)
+        print("table\tmod\tchord\tbits\tchar\tcount\tlatency\terror\tinterval\tcost")
+        for cost,table,mi,chord,n,lat,err,mean_tr in rows[:topn]:
+            print("%s\t%s\t%d\t%d\t%s\t%d\t%.1f\t%.1f%%\t%.1f\t%.1f" %
+                  (table, MODIFIER_KEYS[mi-1] if mi else '-', chord,
+                   chord_fingers(chord).bit_count(),
+                   self.chord_name(codetable, table, mi, chord), n,
+                   lat/1E6, err*100, mean_tr/1E6, cost/1E9))
+        print("(latency and interval in msec, cost in sec)")
+        print("fingers\tcount\tlatency(msec)\terror")
+        for i in range(NBITS):
+            if not self.bccount[i]: continue
+            print("%d\t%d\t%.1f\t%.1f%%" % (i, self.bccount[i], self.bclat[i]/self.bccount[i]/1E6,
+                                          self.bcerrors[i]*100/self.bccount[i]))
+        print("changed fingers\tcount\tmean interval(msec)")
+        for i in range(6):
+            if not self.fmcount[i]: continue
+            print("%d\t%d\t%.1f" % (i, self.fmcount[i], self.fmsum[i]/self.fmcount[i]/1E6))
+
+def parse_args():
+    pname=sys.argv[0]
+    i=pname.rfind('/')
+    if i>=0: pname=pname[i+1:]
+    opt_parser=argparse.ArgumentParser(prog=pname,
+                                       description="binary5 keyboard chord usage profiler")
+    opt_parser.add_argument("logfiles", nargs='*',
+                            help="log files written by 'bin5ring.py -o'")
+    opt_parser.add_argument("-e", "--events", nargs='?', default=None,
+                            help="read the live event ring, stop by Ctrl-C")
+    opt_parser.add_argument("-n", "--top", nargs='?', default=20, type=int,
+                            help="number of chords in the report")
+    opt_parser.add_argument("-p", "--heatmap", nargs='?', default=None,
+                            help="prefix of heatmap png files, no heatmap if not set")
+    return opt_parser.parse_args()
+
+if __name__ == "__main__":
+    options=parse_args()
+    profile=ChordProfile()
+    for logfile in options.logfiles:
+        for rec in read_log(logfile):
+            profile.add(rec)
+    if options.events:
+        reader=EventRingReader(options.events)
+        try:
+            for rec in reader.follow():
+                profile.add(rec)
+        except KeyboardInterrupt:
+            pass
+        reader.close()
+    codetable=CodeTable()
+    if codetable.readconf(verbose=False)!=0: codetable=None
+    profile.print_report(codetable, options.top)
+    if options.heatmap:
+        from bkbpractice import FingersImage
+        fimage=FingersImage()
+        freq,cost=profile.finger_weights()
+        fimage.createheatmap(freq, "frequency", options.heatmap+"_freq.png")
+        fimage.createheatmap(cost, "time", options.heatmap+"_cost.png")
+    sys.exit(0)
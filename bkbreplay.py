@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024 Shiro Ninomiya
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <https://www.gnu.org/licenses/old-licenses/gpl-2.0.html>.
+#
+'''
+Headless replay of practice sessions.
+
+A trace recorded by 'bkbpractice.py -r' is replayed through
+PracticeOneKey.play/tplay on a virtual clock, without the display and
+the hardware.  Synthetic typists can be generated instead of the traces.
+Sessions run in parallel on all cpus, and a scored report is printed.
+'''
+import argparse
+import io
+import logging
+import multiprocessing
+import os
+import random
+import sys
+from contextlib import redirect_stdout
+from bkbpractice import PraCodeTable, PracticeOneKey
+from keysw_ft232 import InputBase_FT232
+
+logger=logging.getLogger('bkbreplay')
+logger.setLevel(logging.INFO)
+
+class TraceInput_FT232(InputBase_FT232):
+    # after the last key event, the replay ends in this time
+    TRACE_TAIL=int(1E9) # 1sec
+    def __init__(self, keyevents: list[tuple[int, int]], start_ts: int):
+        super().__init__()
+        self.keyevents=keyevents
+        self.ei=0
+        self.keys=0
+        self.vts=start_ts
+        self.end_ts=(keyevents[-1][0] if keyevents else start_ts)+self.TRACE_TAIL
+
+    def probe_device(self) -> bool:
+        self.scan_ts=self.vts
+        return True
+
+    def now_ns(self) -> int:
+        return self.vts
+
+    def sleep_ns(self, nsec: int) -> None:
+        if nsec>0: self.vts+=nsec
+
+    def key_status(self) -> int:
+        while self.ei<len(self.keyevents) and self.keyevents[self.ei][0]<=self.vts:
+            self.keys=self.keyevents[self.ei][1]
+            self.ei+=1
+        return self.keys
+
+    def finished(self) -> bool:
+        return self.vts>=self.end_ts
+
+class VirtualKeyin(object):
+    # KeyinPoller on the virtual clock, the console input comes at the end of the trace
+    def __init__(self, tdev: TraceInput_FT232):
+        self.tdev=tdev
+
+    def wait(self, timeout: float=0.0) -> bool:
+        self.tdev.sleep_ns(int(timeout*1E6))
+        return self.tdev.finished()
+
+def parse_trace(lines: list[str]) -> tuple[tuple, list[tuple[int, str]], list[tuple[int, int]]]:
+    header=(1, 4, 0.5, 2.0)
+    prompts=[]
+    keyevents=[]
+    for line in lines:
+        line=line.rstrip('\n')
+        if not line: continue
+        items=line.split(' ', 2)
+        if items[0]=='T':
+            items=line.split()
+            header=(int(items[1]), int(items[2]), float(items[3]), float(items[4]))
+        elif items[0]=='W':
+            prompts.append((int(items[1]), bytes(items[2], 'ascii').decode('unicode_escape')))
+        elif items[0]=='K':
+            keyevents.append((int(items[1]), int(items[2])))
+    return (header, prompts, keyevents)
+
+def replay(lines: list[str], conffile: str="config.org") -> dict:
+    (mode, wordlen, gap, interval),prompts,keyevents=parse_trace(lines)
+    start_ts=min(prompts[0][0] if prompts else 0, keyevents[0][0] if keyevents else 0)
+    codetable=PraCodeTable()
+    with redirect_stdout(io.StringIO()):
+        if codetable.readconf(conffile, verbose=False)!=0:
+            raise ValueError("can't read %s" % conffile)
+        tdev=TraceInput_FT232(keyevents, start_ts)
+        codetable.now_ns=tdev.now_ns
+        pkey=PracticeOneKey('trace', codetable, tdev=tdev)
+        pkey.keyin=VirtualKeyin(tdev)
+        pkey.prompts=iter([p[1] for p in prompts])
+        if mode==0:
+            pkey.play(0, gap=gap, interval=interval)
+        else:
+            pkey.tplay(0, wordlen)
+    stats=pkey.stats
+    return {'total':stats.total, 'correct':stats.correct,
+            'latencies':stats.latencies, 'duration':stats.last_ts-stats.start_ts}
+
+def synth_trace(codetable: PraCodeTable, pstr: str, mode: int, nprompts: int,
+                wordlen: int, seed: int, mean: float=300.0, sd: float=80.0,
+                errrate: float=0.05, gap: float=0.5, interval: float=2.0) -> list[str]:
+    # a synthetic typist, 'mean' and 'sd' are the chord interval in msec
+    rnd=random.Random(seed)
+    keys=[i for i in range(1, 32) if codetable.keytable[i] and
+          codetable.keytable[i]['key'] not in codetable.modifiers]
+    lines=["T %d %d %f %f" % (mode, wordlen, gap, interval)]
+    ts=int(1E9)
+    def chord(bits: int) -> None:
+        nonlocal ts
+        # more fingers, more time
+        ts+=int(max(rnd.gauss(mean*(0.8+0.1*bits.bit_count()), sd), 40)*1E6)
+        lines.append("K %d %d" % (ts, bits))
+        ts+=int(max(rnd.gauss(90, 20), 40)*1E6)
+        lines.append("K %d 0" % ts)
+    for n in range(nprompts):
+        if mode==0:
+            word=rnd.choice(pstr)
+        else:
+            word=''.join(rnd.choice(pstr) for i in range(wordlen))
+        lines.append("W %d %s" % (ts, word.encode('unicode_escape').decode('ascii')))
+        for k in word:
+            kt=codetable.chr2code(k)
+            if rnd.random()<errrate or (kt[1]==0 and k!=' '):
+                chord(rnd.choice(keys))
+                if mode==0:
+                    # wait for the right answer on the graphic
+                    ts+=int((gap*(2 if kt[0] else 1)+interval)*1E9)
+                    break
+                continue
+            if k==' ':
+                chord(0x40)
+                continue
+            if kt[0]: chord(kt[0])
+            chord(kt[1])
+    return lines
+
+def run_session(task: tuple) -> tuple[str, dict]:
+    name,conffile,params=task
+    if params:
+        codetable=PraCodeTable()
+        with redirect_stdout(io.StringIO()):
+            if codetable.readconf(conffile, verbose=False)!=0:
+                raise ValueError("can't read %s" % conffile)
+        lines=synth_trace(codetable, **params)
+    else:
+        with open(name, "r") as inf:
+            lines=inf.readlines()
+    return (name, replay(lines, conffile))
+
+def score(result: dict) -> str:
+    lats=sorted(result['latencies'])
+    if not lats: return "no input"
+    dts=result['duration']
+    return "chars:%d, accuracy:%.1f%%, wpm:%.1f, latency(msec) p50:%.0f p90:%.0f p99:%.0f" % \
+        (result['total'], result['correct']*100/result['total'],
+         result['total']/5/(dts/60E9) if dts else 0.0,
+         lats[len(lats)//2]/1E6, lats[len(lats)*9//10]/1E6, lats[len(lats)*99//100]/1E6)
+
+def parse_args():
+    pname=sys.argv[0]
+    i=pname.rfind('/')
+    if i>=0: pname=pname[i+1:]
+    opt_parser=argparse.ArgumentParser(prog=pname,
+                                       description="binary5 keyboard headless practice replay")
+    opt_parser.add_argument("traces", nargs='*',
+                            help="trace files recorded by 'bkbpractice.py -r'")
+    opt_parser.add_argument("-f", "--config", nargs='?', default="config.org",
+                            help="key code configuration file")
+    opt_parser.add_argument("-j", "--jobs", nargs='?', default=os.cpu_count(), type=int,
+                            help="number of parallel processes")
+    opt_parser.add_argument("-n", "--synth", nargs='?', default=0, type=int,
+                            help="number of synthetic typist sessions")
+    opt_parser.add_argument("-s", "--string", nargs='?', default="abcdefghijklmnopqrstuvwxyz",
+                            help="charcters set of synthetic sessions")
+    opt_parser.add_argument("-m", "--mode", nargs='?', default=1, type=int,
+                            help="practice mode of synthetic sessions, 0:graphics, 1:text")
+    opt_parser.add_argument("-p", "--prompts", nargs='?', default=50, type=int,
+                            help="number of prompts in a synthetic session")
+    opt_parser.add_argument("-w", "--wordlen", nargs='?', default=4, type=int,
+                            help="word length of synthetic sessions")
+    opt_parser.add_argument("-e", "--errrate", nargs='?', default=0.05, type=float,
+                            help="error rate of synthetic typists")
+    opt_parser.add_argument("-v", "--verbose", action='store_true',
+                            help="print the score of each session")
+    return opt_parser.parse_args()
+
+if __name__ == "__main__":
+    options=parse_args()
+    tasks=[(trace, options.config, None) for trace in options.traces]
+    for i in range(options.synth):
+        tasks.append(("synth%d" % i, options.config,
+                      {'pstr':options.string, 'mode':options.mode, 'nprompts':options.prompts,
+                       'wordlen':options.wordlen, 'seed':i, 'errrate':options.errrate}))
+    if not tasks:
+        logger.error("no trace file and no synthetic session")
+        sys.exit(1)
+    total={'total':0, 'correct':0, 'latencies':[], 'duration':0}
+    with multiprocessing.Pool(options.jobs) as pool:
+        for name,result in pool.imap_unordered(run_session, tasks):
+            if options.verbose: print("%s: %s" % (name, score(result)))
+            for k in ('total', 'correct', 'duration'): total[k]+=result[k]
+            total['latencies'].extend(result['latencies'])
+    print("%d sessions, %s" % (len(tasks), score(total)))
+    sys.exit(0)
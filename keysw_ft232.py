@@ -21,8 +21,6 @@ import logging
 import time
 import os
 os.environ["BLINKA_FT232H"]="1"
-import board
-import digitalio
 from copy import deepcopy
 
 logger=logging.getLogger('keysw_ft232')
@@ -31,18 +29,29 @@ logger.setLevel(logging.INFO)
 class CodeTable(object):
     MODLOCK_TIMEOUT = 500000000
     RESET_MODIFIERS = {'M1':0,'M2':0,'M3':0,'M4':0,'M5':0}
-    def readconf(self, conffile: str="config.org") -> int:
+    KEY_COLUMNS = ('key','M1','M2','M3','M4','M5')
+    TABLE_NAME_MAX = 8 # ascii characters, a table name is recorded in the chord events
+    def readconf(self, conffile: str="config.org", verbose: bool=True) -> int:
         inf=open(conffile, "r")
         started=False
-        self.keytables={'A':[None]*32, 'B':[None]*32}
+        # any number of tables, a heading '** code table NAME' starts a table
+        self.keytables={}
+        self.tables=[]
         while True:
             keydef={}
             line=inf.readline()
             if line=='': break
             if not started:
-                if line.find('code table')>0:
-                    self.csel=line.strip()[-1]
-                    if self.csel=='A' or self.csel=='B':
+                if line[0]=='*' and line.find('code table')>0:
+                    tname=line.split('code table', 1)[1].strip()
+                    if not tname.isascii() or len(tname)>self.TABLE_NAME_MAX:
+                        logger.error("table name '%s' must be ascii in %d characters" %
+                                     (tname, self.TABLE_NAME_MAX))
+                        return -1
+                    if tname:
+                        if tname not in self.keytables:
+                            self.keytables[tname]=[None]*32
+                            self.tables.append(tname)
                         started=True
                 continue
             if line[0]!='|':
@@ -61,28 +70,75 @@ class CodeTable(object):
             if items[4].strip()=='':
                 logger.error("'key' item is not defined")
                 return -1
-            for i,j in enumerate(('key','M1','M2','M3','M4','M5')):
+            for i,j in enumerate(self.KEY_COLUMNS):
                 keydef[j]=items[4+i].strip()
-            self.keytables[self.csel][dcode]=keydef
+            self.keytables[tname][dcode]=keydef
         inf.close()
+        if not self.tables:
+            logger.error("no code table in %s" % conffile)
+            return -1
+        if self.compile_tables()!=0: return -1
         self.modifiers = deepcopy(self.RESET_MODIFIERS)
+        # the modifiers returned by code2char, updated in place
+        self.modsnap = deepcopy(self.RESET_MODIFIERS)
         self.lastmod = ''
         self.modts = 0
-        self.csel='A'
-        self.printconf()
+        self.layer_ret = ''
+        self.select_table(self.tables[0])
+        if verbose: self.printconf()
+        return 0
+
+    def compile_tables(self) -> int:
+        # make the lookup maps of all tables at the load time,
+        # then switching a table is only replacing the references
+        self.chrmaps={}
+        self.layers=set()
+        for tname in self.tables:
+            keytable=self.keytables[tname]
+            keycodes={}
+            for i,keydef in enumerate(keytable):
+                if keydef and keydef['key'] not in keycodes: keycodes[keydef['key']]=i
+            chrmap={}
+            for i,keydef in enumerate(keytable):
+                if keydef==None: continue
+                for j in self.KEY_COLUMNS:
+                    kchr=keydef[j]
+                    if not kchr: continue
+                    if kchr[:3] in ('TB:', 'LY:'):
+                        if kchr[3:] not in self.keytables:
+                            logger.error("table '%s' is not defined" % kchr[3:])
+                            return -1
+                        if kchr[:3]=='LY:': self.layers.add(kchr[3:])
+                    if kchr in chrmap: continue
+                    if j=='key':
+                        chrmap[kchr]=(0, i)
+                    else:
+                        chrmap[kchr]=(keycodes.get(j, 0), i)
+            self.chrmaps[tname]=chrmap
+        # the next table of 'SWTB', momentary layers are skipped
+        self.nexttables={}
+        for i,tname in enumerate(self.tables):
+            self.nexttables[tname]=tname
+            for j in range(1, len(self.tables)):
+                nname=self.tables[(i+j)%len(self.tables)]
+                if nname not in self.layers:
+                    self.nexttables[tname]=nname
+                    break
         return 0
 
     def printconf(self):
-        for i,keydef in enumerate(self.keytables[self.csel]):
+        for i,keydef in enumerate(self.keytable):
             if i==0:
                 print("bcode\t", end='')
             else:
                 print("%s\t" % bin(i+32)[3:], end='')
-            for n in ('key','M1','M2','M3','M4','M5'):
+            for n in self.KEY_COLUMNS:
                 if i==0:
                     print("%s\t" % n, end='')
-                else:
+                elif keydef:
                     print("%s\t" % keydef[n], end='')
+                else:
+                    print("\t", end='')
             print()
 
     def modstate_print(self) -> None:
@@ -92,45 +148,88 @@ class CodeTable(object):
             print("%s:%d " % (k,v), end='')
         print("", end='\r', flush=True)
 
-    def switch_config(self) -> None:
-        if self.csel=='B':
-            self.csel='A'
+    def select_table(self, tname: str) -> None:
+        self.csel=tname
+        self.keytable=self.keytables[tname]
+        self.chrmap=self.chrmaps[tname]
+
+    def switch_config(self, kchr: str='SWTB') -> None:
+        # 'SWTB':the next table except momentary layers,
+        # 'TB:NAME':select NAME, 'LY:NAME':use NAME only for the next chord
+        if kchr[:3]=='TB:':
+            self.layer_ret=''
+            self.select_table(kchr[3:])
+        elif kchr[:3]=='LY:':
+            if not self.layer_ret: self.layer_ret=self.csel
+            self.select_table(kchr[3:])
         else:
-            if self.keytables[self.csel][1]:
-                self.csel='B'
-        self.printconf()
+            tname=self.layer_ret if self.layer_ret else self.csel
+            self.layer_ret=''
+            self.select_table(self.nexttables[tname])
+        self.modstate_print()
+
+    def release_modifiers(self) -> None:
+        for k,v in self.modifiers.items():
+            if v!=2: self.modifiers[k]=0 # clear all unlocked modifiers
+        self.lastmod=''
+        self.modstate_print()
+
+    def end_layer(self) -> None:
+        # a momentary layer ends by a decoded chord
+        if not self.layer_ret: return
+        self.select_table(self.layer_ret)
+        self.layer_ret=''
+        self.modstate_print()
+
+    def is_switch(self, kchr: str) -> bool:
+        return kchr=='SWTB' or kchr[:3] in ('TB:', 'LY:')
 
     def code2char(self, dcode: int) -> tuple[str, str, dict]:
+        # the returned modifiers are valid until the next call, don't modify them
         spbs=dcode&0x60
         dcode=dcode&0x1f
         if spbs:
+            # the thumb keys are decoded chords, and end a momentary layer
+            self.end_layer()
             if spbs&0x20:
-                return ('s', 'BS', deepcopy(self.RESET_MODIFIERS))
+                return ('s', 'BS', self.RESET_MODIFIERS)
             else:
-                return ('t', 'SP', deepcopy(self.RESET_MODIFIERS))
-        keydef=self.keytables[self.csel][dcode]
+                return ('t', 'SP', self.RESET_MODIFIERS)
+        keydef=self.keytable[dcode]
+        if keydef==None:
+            # not defined in this table, drop the chord with the pending modifiers
+            if self.lastmod and self.modifiers[self.lastmod]!=2:
+                self.release_modifiers()
+            self.end_layer()
+            return ('','',None)
         ik=keydef['key']
         if ik not in self.modifiers:
-            rm=deepcopy(self.modifiers)
+            rm=self.modsnap
+            rm.update(self.modifiers)
             if not self.lastmod:
+                if self.is_switch(ik):
+                    self.switch_config(ik)
+                    return ('','',None)
+                self.end_layer()
                 return (ik,'', rm) # regular key without modifier
             mk=keydef[self.lastmod] # modified with the last modifier
-            if mk=='SWTB': ik=''
+            if self.is_switch(mk): ik=''
             if self.modifiers[self.lastmod]!=2:
                 # last modifier is not locked
-                for k,v in self.modifiers.items():
-                    if v!=2: self.modifiers[k]=0 # clear all unlocked modifiers
-                self.lastmod=''
-                self.modstate_print()
-                if mk=='SWTB': self.switch_config()
+                self.release_modifiers()
+                if self.is_switch(mk):
+                    self.switch_config(mk)
+                else:
+                    self.end_layer()
                 return (ik, mk, rm)
             else:
                 # last modifier is locked
+                if not self.is_switch(mk): self.end_layer()
                 return (ik, mk, rm)
         # got a modifier key
         if ik==self.lastmod:
             if self.modifiers[self.lastmod]==1:
-                ts=time.time_ns()
+                ts=self.now_ns()
                 if ts-self.modts < self.MODLOCK_TIMEOUT:
                     logger.debug("modifiere %s=2" % self.lastmod)
                     if self.modifiers[self.lastmod]!=2:
@@ -161,46 +260,145 @@ class CodeTable(object):
                 self.modstate_print()
             else:
                 logger.debug("modifiere %s=1" % ik)
-                self.modts=time.time_ns()
+                self.modts=self.now_ns()
                 self.modifiers[ik]=1
                 self.lastmod=ik
                 self.modstate_print()
         return ('','',None)
 
+    def now_ns(self) -> int:
+        # replaced by a virtual clock in the trace replay
+        return time.time_ns()
+
     def modfier_status(self, mkey:str) -> int:
         if mkey not in self.modifiers: return 0
         return self.modifiers[mkey]
 
+def release_ftdi(controller=None) -> None:
+    # Blinka keeps the pyftdi controllers of an unplugged FT232H,
+    # terminate them and flush the usb device cache to probe it again
+    ctrls=[controller]
+    try:
+        from adafruit_blinka.microcontroller.ftdi_mpsse.mpsse.pin import Pin
+        ctrls.append(Pin.mpsse_gpio)
+        Pin.mpsse_gpio=None
+    except ImportError:
+        pass
+    for ctrl in ctrls:
+        try:
+            if hasattr(ctrl, 'terminate'): ctrl.terminate()
+        except Exception:
+            pass
+    try:
+        from pyftdi.usbtools import UsbTools
+        UsbTools.flush_cache()
+    except ImportError:
+        pass
+
 class InputBase_FT232(object):
     KEY_VALID_MIN=int(20E6) # 20msec
     KEY_INVALID_MIN=int(20E6) # 20msec
     KEY_REPEAT_START=int(400E6) # 300msec
     SCAN_KEY_MIN_INTERVAL=int(10E6) # 10msec
+    SCAN_KEY_MAX_INTERVAL=int(50E6) # 50msec, worst case latency to detect the first key
+    SCAN_IDLE_START=int(1E9) # 1sec, no key in this time starts the backoff
+    SCAN_BACKOFF_RATIO=1.25
     def __init__(self):
         self.scan_ts=0
+        self.scan_interval=self.SCAN_KEY_MIN_INTERVAL
+        self.max_interval=self.SCAN_KEY_MAX_INTERVAL
+        self.idle_ts=0
+        self.scan_count=0
+        self.stats_ts=0
+        self.stats_count=0
+        self.stats_cpu=0
         self.last_keys=0
         self.stable_ts=0
         self.stable_keys=0
         self.maxbitn=0
         self.repeat=False
+        self.scan_dts=0
+        self.scan_target=0 # the interval which the last scan waited for
+        self.press_ts=0
         super().__init__()
 
+    def reset_scan(self) -> None:
+        # forget the key status, used after reconnecting the device
+        self.last_keys=0
+        self.stable_ts=0
+        self.stable_keys=0
+        self.maxbitn=0
+        self.repeat=False
+        self.idle_ts=0
+        self.scan_interval=self.SCAN_KEY_MIN_INTERVAL
+        self.scan_ts=self.now_ns()
+
+    def reconnect(self) -> bool:
+        if not self.probe_device(): return False
+        self.reset_scan()
+        return True
+
+    def set_max_latency(self, latency: int) -> None:
+        # the scan interval never goes over 'latency' in idle
+        self.max_interval=max(latency, self.SCAN_KEY_MIN_INTERVAL)
+
+    def log_poll_stats(self) -> None:
+        ts=time.time_ns()
+        cpu=time.process_time_ns()
+        if self.stats_ts:
+            dts=ts-self.stats_ts
+            logger.info("scans=%.1f/sec, cpu=%.2f%%, interval=%.1fmsec" %
+                        ((self.scan_count-self.stats_count)*1E9/dts,
+                         (cpu-self.stats_cpu)*100/dts, self.scan_interval/1E6))
+        self.stats_ts=ts
+        self.stats_count=self.scan_count
+        self.stats_cpu=cpu
+
+    def now_ns(self) -> int:
+        # replaced by a virtual clock in the trace replay
+        return time.time_ns()
+
+    def sleep_ns(self, nsec: int) -> None:
+        time.sleep(nsec/1E9)
+
+    def key_pending(self) -> bool:
+        # True while a touch is being detected, and the scan goes back to the full rate
+        return False
+
+    def scan_delay(self) -> int:
+        # nsec until the next scan is due
+        return max(self.scan_interval-(self.now_ns()-self.scan_ts), 0)
+
     # return (key_status, change_status, repeta_status)
     # change_status becomes True when (NOT PUSHED -> PUSHED) OR (PUSHED -> NOT PUSHED)
     # repeat_status becomes True when (PUSHED time >= KEY_REPEAT_START)
     def scan_key(self) -> tuple[int,bool,bool]:
-        ts=time.time_ns()
+        ts=self.now_ns()
         dts=ts-self.scan_ts
         # for at42qt1070, dts is around 16-18 msec, and no sleep happens
         # for keysw, dts is less than 1 msec, and sleep happens
-        if dts<self.SCAN_KEY_MIN_INTERVAL:
-                time.sleep((self.SCAN_KEY_MIN_INTERVAL-dts)/1E9)
-                ts=time.time_ns()
+        # in idle, scan_interval becomes longer, and sleep happens for both
+        if dts<self.scan_interval:
+                self.sleep_ns(self.scan_interval-dts)
+                ts=self.now_ns()
                 dts=ts-self.scan_ts
         self.scan_ts=ts
+        self.scan_dts=dts
+        self.scan_target=self.scan_interval
         keys=self.key_status()
+        self.scan_count+=1
+        if keys or self.last_keys or self.stable_keys or self.key_pending():
+            # back to the full rate by the first detected bit
+            self.idle_ts=0
+            self.scan_interval=self.SCAN_KEY_MIN_INTERVAL
+        else:
+            self.idle_ts+=dts
+            if self.idle_ts>=self.SCAN_IDLE_START and self.scan_interval<self.max_interval:
+                self.scan_interval=min(int(self.scan_interval*self.SCAN_BACKOFF_RATIO),
+                                       self.max_interval)
         if keys!=self.last_keys:
             #print(bin(keys))
+            if not self.last_keys: self.press_ts=ts
             self.last_keys=keys
             self.stable_ts=0
         else:
@@ -230,6 +428,9 @@ class InputBase_FT232(object):
 
 class KeySw_FT232(InputBase_FT232):
     def probe_device(self) -> bool:
+        # hardware modules are imported only when the device is used
+        import board
+        import digitalio
         self.keys=[None]*7
         self.keys[0]=digitalio.DigitalInOut(board.C0)
         self.keys[1]=digitalio.DigitalInOut(board.C1)
@@ -243,6 +444,15 @@ class KeySw_FT232(InputBase_FT232):
         self.scan_ts=time.time_ns()
         return True
 
+    def reconnect(self) -> bool:
+        for key in self.keys:
+            try:
+                key.deinit()
+            except Exception:
+                pass
+        release_ftdi()
+        return super().reconnect()
+
     def key_status(self) -> int:
         result=0
         for i in range(5):
@@ -0,0 +1,16 @@
+import os
+import sys
+import types
+
+ROOT=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the hardware and uhid modules are not needed by the tests,
+# empty modules are used when they are not installed
+for name in ('board', 'digitalio', 'uhid'):
+    try:
+        __import__(name)
+    except ImportError:
+        sys.modules[name]=types.ModuleType(name)
+if not hasattr(sys.modules['uhid'], 'UHIDDevice'):
+    sys.modules['uhid'].UHIDDevice=object
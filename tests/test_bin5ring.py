@@ -0,0 +1,63 @@
+import os
+from bin5ring import EventRingReader, EventRingWriter
+
+MODS={'M1':0, 'M2':1, 'M3':0, 'M4':0, 'M5':0}
+
+def publish(writer: EventRingWriter, n: int) -> None:
+    for i in range(n):
+        writer.publish(i, 0, 1, 1, 'A', MODS, (0,)*8)
+
+def test_restart_continues_ring(tmp_path):
+    path=str(tmp_path/"events")
+    writer=EventRingWriter(path, 8)
+    publish(writer, 3)
+    reader=EventRingReader(path, from_start=True)
+    assert len(reader.read())==3
+    writer.close()
+    ino=os.stat(path).st_ino
+    writer=EventRingWriter(path, 8)
+    assert writer.head==3 and os.stat(path).st_ino==ino
+    publish(writer, 2)
+    events=reader.read()
+    assert [ev.ts for ev in events]==[0, 1]
+    assert events[0].modifiers==MODS and events[0].table=='A'
+
+def test_resized_ring_is_new_file(tmp_path):
+    path=str(tmp_path/"events")
+    writer=EventRingWriter(path, 8)
+    publish(writer, 5)
+    reader=EventRingReader(path)
+    writer=EventRingWriter(path, 16)
+    assert writer.head==0 and reader.replaced()
+    publish(writer, 2)
+    # the old mapping is still readable
+    assert reader.read()==[]
+    reader=EventRingReader(path, from_start=True)
+    assert len(reader.read())==2
+
+def test_reader_resyncs_behind_head(tmp_path):
+    path=str(tmp_path/"events")
+    writer=EventRingWriter(path, 8)
+    publish(writer, 5)
+    reader=EventRingReader(path)
+    # a writer which restarts the ring in place
+    writer.head=0
+    publish(writer, 2)
+    assert reader.read()==[]
+    publish(writer, 1)
+    assert [ev.ts for ev in reader.read()]==[0]
+
+def test_table_name_cut_in_a_character(tmp_path):
+    path=str(tmp_path/"events")
+    writer=EventRingWriter(path, 8)
+    reader=EventRingReader(path)
+    writer.publish(0, 0, 1, 1, 'symbols·', MODS, (0,)*8)
+    assert reader.read()[0].table=='symbols�'
+
+def test_publish_caches_encoded_values(tmp_path):
+    writer=EventRingWriter(str(tmp_path/"events"), 8)
+    report=(0,0,4,0,0,0,0,0)
+    publish(writer, 2)
+    writer.publish(0, 0, 1, 1, 'A', MODS, report)
+    writer.publish(0, 0, 1, 1, 'A', MODS, report)
+    assert list(writer.tnames)==['A'] and len(writer.reports)==2
@@ -0,0 +1,24 @@
+import itertools
+import bkbpractice
+from bkbpractice import PraCodeTable, PracticeOneKey
+from bkbreplay import TraceInput_FT232
+
+def make_practice(monkeypatch, pstr: str) -> PracticeOneKey:
+    # no console input in the tests
+    monkeypatch.setattr(bkbpractice, 'KeyinPoller', object)
+    return PracticeOneKey('trace', PraCodeTable(), pstr=pstr, tdev=TraceInput_FT232([], 0))
+
+def test_nextword_no_limit_without_corpus(monkeypatch):
+    pkey=make_practice(monkeypatch, "abc")
+    words=list(itertools.islice(pkey.nextword(0), 3))
+    assert [len(w) for w in words]==[PracticeOneKey.DEFAULT_WORDLEN]*3
+
+def test_nextword_no_word_fits_corpus(monkeypatch):
+    pkey=make_practice(monkeypatch, "abc")
+    words=list(itertools.islice(pkey.nextword(0, ["xyz"]), 2))
+    assert all(len(w)==PracticeOneKey.DEFAULT_WORDLEN and set(w)<=set("abc") for w in words)
+
+def test_nextword_corpus_max_length(monkeypatch):
+    pkey=make_practice(monkeypatch, "abc")
+    words=set(itertools.islice(pkey.nextword(2, ["ab", "abc", "ca"]), 20))
+    assert words<={"ab", "ca"}
@@ -0,0 +1,48 @@
+from bin5ring import EventRingReader, EventRingWriter
+from bkbprofile import CHORD_BS, NCHORDS, ChordProfile
+
+NOMODS={'M1':0, 'M2':0, 'M3':0, 'M4':0, 'M5':0}
+M2={'M1':0, 'M2':1, 'M3':0, 'M4':0, 'M5':0}
+
+def profile_events(tmp_path, events: list[tuple]) -> ChordProfile:
+    # events are (ts in msec, bits, modifiers, usage id in the report)
+    path=str(tmp_path/"events")
+    writer=EventRingWriter(path, 64)
+    reader=EventRingReader(path)
+    for ts,bits,mods,usage in events:
+        writer.publish(int(ts*1E6), int(10E6), bits, bits&0x1f, 'A', mods,
+                       (0,0,usage,0,0,0,0,0))
+    profile=ChordProfile()
+    for rec in reader.read_raw():
+        profile.add(rec)
+    return profile
+
+def test_touchpad_bs_counts_error(tmp_path):
+    # 'a', M2, M2+s(BS): 'a' is erased
+    profile=profile_events(tmp_path, [(100, 3, NOMODS, 0x04), (300, 2, NOMODS, 0),
+                                      (500, 10, M2, 0x2a)])
+    assert profile.errors[0][3]==1
+    assert profile.bcerrors[2]==1
+    assert list(profile.bccount)==[0, 1, 2, 0, 0, 0]
+
+def test_thumb_bs_counts_error(tmp_path):
+    profile=profile_events(tmp_path, [(100, 7, NOMODS, 0x11), (300, 0x20, NOMODS, 0x2a)])
+    assert profile.errors[0][7]==1
+    assert profile.counts[0][CHORD_BS]==1
+    assert profile.bcerrors[3]==1
+
+def test_transition_cost(tmp_path):
+    # a pause longer than PAUSE_GAP is not a transition
+    profile=profile_events(tmp_path, [(100, 3, NOMODS, 0x04), (400, 5, NOMODS, 0x12),
+                                      (600, 3, NOMODS, 0x04), (5000, 5, NOMODS, 0x12)])
+    assert profile.chord_cost(5)==(1, int(300E6))
+    assert profile.chord_cost(3)==(1, int(200E6))
+    assert profile.trcount[3*NCHORDS+5]==1
+    assert profile.fmcount[(3^5).bit_count()]==2
+
+def test_finger_weights(tmp_path):
+    profile=profile_events(tmp_path, [(100, 1, NOMODS, 0x04), (200, 1, NOMODS, 0x04),
+                                      (300, 3, NOMODS, 0x04)])
+    freq,cost=profile.finger_weights()
+    assert freq==[1.0, 1/3, 0.0, 0.0, 0.0]
+    assert cost[0]==1.0
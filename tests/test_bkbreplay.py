@@ -0,0 +1,68 @@
+import os
+import pytest
+import bkbpractice
+from bkbpractice import PraCodeTable, PracticeOneKey, TraceRecorder
+from bkbreplay import TraceInput_FT232, VirtualKeyin, parse_trace, replay, \
+    run_session, score, synth_trace
+from conftest import ROOT
+
+CONFFILE=os.path.join(ROOT, "config.org")
+
+@pytest.fixture(autouse=True)
+def no_console(monkeypatch):
+    # no console input in the tests
+    monkeypatch.setattr(bkbpractice, 'KeyinPoller', object)
+
+def make_codetable() -> PraCodeTable:
+    codetable=PraCodeTable()
+    assert codetable.readconf(CONFFILE, verbose=False)==0
+    return codetable
+
+def typist(chords: list[int], start_ts: int) -> list[tuple[int, int]]:
+    # a chord every 300 msec, pushed for 100 msec
+    events=[]
+    for i,bits in enumerate(chords):
+        ts=start_ts+int((i+1)*300E6)
+        events+=[(ts, bits), (ts+int(100E6), 0)]
+    return events
+
+def test_record_and_replay(tmp_path):
+    tracefile=str(tmp_path/"trace")
+    codetable=make_codetable()
+    # 'ab', 'ba' typed as 'ab', 'aa'
+    tdev=TraceInput_FT232(typist([3, 31, 3, 3], int(1E9)), int(1E9))
+    codetable.now_ns=tdev.now_ns
+    pkey=PracticeOneKey('trace', codetable, tdev=tdev)
+    pkey.keyin=VirtualKeyin(tdev)
+    pkey.prompts=iter(["ab", "ba"])
+    pkey.trace=TraceRecorder(tracefile, tdev, 1, 2, 0.5, 2.0)
+    pkey.tplay(2, 2)
+    pkey.trace.close()
+    assert (pkey.stats.total, pkey.stats.correct)==(4, 3)
+    with open(tracefile, "r") as inf:
+        lines=inf.readlines()
+    header,prompts,keyevents=parse_trace(lines)
+    assert header==(1, 2, 0.5, 2.0)
+    assert [p[1] for p in prompts]==["ab", "ba"]
+    assert [bits for ts,bits in keyevents]==[0, 3, 0, 31, 0, 3, 0, 3, 0]
+    result=replay(lines, CONFFILE)
+    assert (result['total'], result['correct'])==(4, 3)
+    assert result['latencies']==pkey.stats.latencies
+
+def test_synthetic_session_without_errors():
+    codetable=make_codetable()
+    lines=synth_trace(codetable, "abcde", 1, 5, 3, seed=1, errrate=0.0)
+    result=replay(lines, CONFFILE)
+    assert result['total']==result['correct']==15
+    assert len(result['latencies'])==15
+    assert score(result).startswith("chars:15, accuracy:100.0%")
+
+def test_score_no_input():
+    assert score({'total':0, 'correct':0, 'latencies':[], 'duration':0})=="no input"
+
+def test_run_session_bad_config(tmp_path):
+    conffile=tmp_path/"bad.org"
+    conffile.write_text("no code table\n")
+    with pytest.raises(ValueError):
+        run_session(("synth0", str(conffile),
+                     {'pstr':"abc", 'mode':1, 'nprompts':1, 'wordlen':2, 'seed':0}))
@@ -0,0 +1,61 @@
+import os
+from conftest import ROOT
+from keysw_ft232 import CodeTable
+
+def make_codetable() -> CodeTable:
+    codetable=CodeTable()
+    assert codetable.readconf(os.path.join(ROOT, "config.org"), verbose=False)==0
+    return codetable
+
+def test_layer_undefined_chord_releases_modifiers():
+    codetable=make_codetable()
+    codetable.code2char(4) # M3
+    codetable.code2char(20) # M3+z, LY:NAV
+    assert codetable.csel=='NAV'
+    codetable.code2char(2) # M2 in NAV
+    assert codetable.code2char(23)==('','',None) # x is not defined in NAV
+    assert codetable.csel=='A'
+    assert codetable.lastmod==''
+    assert codetable.modifiers['M2']==0
+    assert codetable.code2char(3)[:2]==('a','')
+
+def test_modifier_snapshot_is_preallocated():
+    codetable=make_codetable()
+    snap=codetable.code2char(3)[2]
+    codetable.code2char(2) # M2
+    ik=codetable.code2char(3)
+    assert ik[2] is snap and ik[2]['M2']==1
+    assert codetable.code2char(0x20)[2] is codetable.RESET_MODIFIERS
+
+def test_switch_table_skips_layers():
+    codetable=make_codetable()
+    assert codetable.tables==['A', 'B', 'NAV', 'EDIT']
+    assert codetable.nexttables=={'A':'B', 'B':'A', 'NAV':'A', 'EDIT':'A'}
+    codetable.switch_config()
+    assert codetable.csel=='B'
+    codetable.switch_config()
+    assert codetable.csel=='A'
+
+def test_edit_layer_from_table_b():
+    codetable=make_codetable()
+    codetable.switch_config('TB:B')
+    codetable.code2char(8) # M4
+    assert codetable.code2char(6)==('','LY:EDIT',codetable.modsnap)
+    assert codetable.csel=='EDIT'
+    assert codetable.code2char(18)[0]=='C-c'
+    assert codetable.csel=='B'
+    assert codetable.modifiers['M4']==0
+
+def test_thumb_key_ends_layer():
+    codetable=make_codetable()
+    codetable.code2char(4) # M3
+    codetable.code2char(20) # M3+z, LY:NAV
+    assert codetable.code2char(0x40)[1]=='SP'
+    assert codetable.csel=='A'
+
+def test_long_table_name_is_rejected(tmp_path):
+    conffile=tmp_path/"config.org"
+    conffile.write_text("** code table NAVIGATION\n"
+                        "| dcode | bits | bcode | key | M1 | M2 | M3 | M4 | M5 |\n"
+                        "| 3 | 2 | 00011 | HOME | | | | | |\n")
+    assert CodeTable().readconf(str(conffile), verbose=False)==-1
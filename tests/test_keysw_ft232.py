@@ -0,0 +1,30 @@
+import sys
+import types
+from keysw_ft232 import release_ftdi
+
+class FakeController(object):
+    def __init__(self):
+        self.terminated=False
+
+    def terminate(self) -> None:
+        self.terminated=True
+
+def test_release_ftdi(monkeypatch):
+    pinmod='adafruit_blinka.microcontroller.ftdi_mpsse.mpsse.pin'
+    names=pinmod.split('.')
+    for i in range(len(names)):
+        monkeypatch.setitem(sys.modules, '.'.join(names[:i+1]),
+                            types.ModuleType('.'.join(names[:i+1])))
+    gpio=FakeController()
+    sys.modules[pinmod].Pin=type('Pin', (object,), {'mpsse_gpio':gpio})
+    flushed=[]
+    usbtools=types.ModuleType('pyftdi.usbtools')
+    usbtools.UsbTools=type('UsbTools', (object,),
+                           {'flush_cache':staticmethod(lambda: flushed.append(True))})
+    monkeypatch.setitem(sys.modules, 'pyftdi', types.ModuleType('pyftdi'))
+    monkeypatch.setitem(sys.modules, 'pyftdi.usbtools', usbtools)
+    i2c=FakeController()
+    release_ftdi(i2c)
+    assert i2c.terminated and gpio.terminated
+    assert sys.modules[pinmod].Pin.mpsse_gpio is None
+    assert flushed
@@ -0,0 +1,67 @@
+from at42qt1070_rawdetect import DeltaDetector, NKEYS, RecordedSignal_FT232, \
+    chord_events, compare
+
+REF=[500]*NKEYS
+
+def signals(key: int, delta: int) -> list[int]:
+    res=list(REF)
+    if key>=0: res[key]-=delta
+    return res
+
+def test_touch_after_on_samples():
+    det=DeltaDetector()
+    assert det.update(signals(-1, 0), REF)==0
+    assert det.update(signals(1, 20), REF)==0
+    assert det.pending()
+    assert det.update(signals(1, 20), REF)==0b10
+    assert not det.pending()
+
+def test_below_threshold_is_noise():
+    det=DeltaDetector()
+    for i in range(10):
+        assert det.update(signals(2, DeltaDetector.MIN_THRESHOLD-1), REF)==0
+    assert not det.pending()
+
+def test_release_by_hysteresis():
+    det=DeltaDetector()
+    for i in range(2): det.update(signals(0, 20), REF)
+    # over the release threshold(HYSTERESIS*threshold), still touched
+    for i in range(3): assert det.update(signals(0, 8), REF)==1
+    assert det.update(signals(0, 4), REF)==1
+    assert det.update(signals(0, 4), REF)==0
+
+def test_baseline_follows_drift():
+    det=DeltaDetector()
+    # the signal goes down slowly, it is not a touch
+    for i in range(2000):
+        assert det.update(signals(3, i//100), REF)==0
+    assert det.baseline[3]<REF[3]-15
+
+def test_raw_detection_is_earlier_than_chip():
+    # 8 msec samples, the chip reports the touch 3 samples after the signal
+    samples=[]
+    ts=0
+    for n in range(200):
+        touched=50<=n<100
+        status=0b100 if 53<=n<103 else 0
+        samples.append((ts, status, signals(2, 40) if touched else list(REF), REF))
+        ts+=int(8E6)
+    chip=chord_events(samples, False)
+    raw=chord_events(samples, True)
+    assert [bits for ts,bits in chip]==[0b100]
+    assert [bits for ts,bits in raw]==[0b100]
+    res=compare(chip, raw)
+    assert res['matched']==1 and res['wrong']==0 and res['extra']==0
+    assert res['gains'][0]>0
+
+def test_compare_counts_wrong_and_extra():
+    res=compare([(int(1E9), 1), (int(2E9), 2)],
+                [(int(1E9), 1), (int(2.1E9), 3), (int(5E9), 4)])
+    assert (res['matched'], res['wrong'], res['extra'])==(1, 1, 1)
+
+def test_pending_touch_stops_backoff():
+    tdev=RecordedSignal_FT232(True)
+    tdev.scan_interval=tdev.max_interval
+    tdev.feed((0, 0, list(REF), REF))
+    tdev.feed((int(50E6), 0, signals(0, 20), REF))
+    assert tdev.scan_interval==tdev.SCAN_KEY_MIN_INTERVAL
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+import uhidbin5
+from bin5ring import EventRingReader, EventRingWriter
+from conftest import ROOT
+
+class FakeDevice(object):
+    def __init__(self):
+        self.reports=[]
+
+    def send_input(self, report: tuple) -> None:
+        self.reports.append(report)
+
+class FakeTdev(object):
+    SCAN_KEY_MIN_INTERVAL=int(10E6)
+    def __init__(self):
+        self.events=[]
+        self.scan_ts=0
+        self.scan_dts=0
+        self.scan_target=self.SCAN_KEY_MIN_INTERVAL
+        self.press_ts=0
+        self.stats_ts=0
+
+    def probe_device(self) -> bool:
+        return True
+
+    def scan_key(self) -> tuple[int, bool, bool]:
+        return self.events.pop(0)
+
+@pytest.fixture
+def buhid(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(uhidbin5, 'KeySw_FT232', FakeTdev)
+    return uhidbin5.Bin5Uhid(FakeDevice(), 'keysw')
+
+class BackoffTdev(FakeTdev):
+    # events are (scan interval, pkey)
+    def scan_key(self) -> tuple[int, bool, bool]:
+        self.scan_target,pkey=self.events.pop(0)
+        self.scan_dts=self.scan_target
+        return (pkey, pkey!=0, False)
+
+def test_jitter_skips_backoff_scans(buhid):
+    buhid.jitter=uhidbin5.JitterStats('test')
+    buhid.tdev=BackoffTdev()
+    buhid.tdev.events=[(int(10E6), 0), (int(30E6), 0), (int(50E6), 0), (int(10E6), 3)]
+    asyncio.run(buhid.get_tinput())
+    assert buhid.jitter.nscan==2
+    assert list(buhid.jitter.scans[:2])==[int(10E6)]*2
+
+def test_ring_records_decoding_table(buhid, tmp_path):
+    path=str(tmp_path/"events")
+    buhid.ring=EventRingWriter(path, 16)
+    reader=EventRingReader(path)
+    # M3, M3+z(LY:NAV), HOME in NAV
+    buhid.tdev.events=[(4,True,False), (20,True,False), (3,True,False)]
+    asyncio.run(buhid.get_tinput())
+    events=reader.read()
+    assert [ev.table for ev in events]==['A', 'A', 'NAV']
+    assert events[1].modifiers['M3']==1
+    assert events[2].report[2]==0x4a
+
+class UnpluggedTdev(FakeTdev):
+    # scan_key fails, and reconnect fails 'nfails' times before it succeeds
+    def __init__(self, nfails: int):
+        super().__init__()
+        self.nfails=nfails
+        self.nreconnect=0
+
+    def scan_key(self) -> tuple[int, bool, bool]:
+        raise OSError("usb device is gone")
+
+    def reconnect(self) -> bool:
+        self.nreconnect+=1
+        if self.nreconnect<=self.nfails:
+            raise OSError("no device")
+        return True
+
+def test_recover_after_scan_failure(buhid, monkeypatch):
+    monkeypatch.setattr(buhid, 'RECONNECT_MIN', 0.001)
+    buhid.tdev=UnpluggedTdev(2)
+    asyncio.run(buhid.get_tinput())
+    assert buhid.tdev.nreconnect==3
+    assert buhid.device.reports==[buhid.ZERO_REPORT]
+
+def test_recover_backoff_is_bounded(buhid, monkeypatch):
+    waits=[]
+    async def sleep(sec: float) -> None:
+        waits.append(sec)
+    monkeypatch.setattr(uhidbin5.asyncio, 'sleep', sleep)
+    buhid.tdev=UnpluggedTdev(10)
+    asyncio.run(buhid.recover(OSError("usb device is gone")))
+    assert waits[0]==buhid.RECONNECT_MIN
+    assert max(waits)==buhid.RECONNECT_MAX
+
+def test_keyreport_cached_by_modifier_state(buhid):
+    mods={'M1':0, 'M2':0, 'M3':0, 'M4':0, 'M5':0}
+    rep=buhid.keyreport('a', '', mods)
+    assert rep==(0,0,0x04,0,0,0,0,0)
+    assert buhid.keyreport('a', '', dict(mods, M2=1)) is rep
+    shifted=buhid.keyreport('a', '', dict(mods, M1=1))
+    assert shifted==(buhid.modifiers['LeftShift'],0,0x04,0,0,0,0,0)
+    assert buhid.keyreport('a', '', dict(mods, M1=2)) is shifted
+
+def test_edit_layer_keys_have_ctrl(buhid):
+    mods={'M1':0, 'M2':0, 'M3':0, 'M4':0, 'M5':0}
+    assert buhid.keyreport('C-c', '', mods)==(buhid.modifiers['LeftCtr'],0,0x06,0,0,0,0,0)
+
+def test_jitter_keeps_first_latency(caplog):
+    jitter=uhidbin5.JitterStats('test')
+    for dts in (int(900E6), int(10E6), int(10E6)):
+        jitter.add_scan(dts)
+    for lts in (int(5E6), int(7E6)):
+        jitter.add_latency(lts)
+    with caplog.at_level('INFO', logger=uhidbin5.logger.name):
+        jitter.report()
+    assert "scan interval: n=2, mean=10000.0" in caplog.text
+    assert "keypress to report: n=2, mean=6000.0" in caplog.text
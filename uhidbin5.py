@@ -18,10 +18,18 @@
 # <https://www.gnu.org/licenses/old-licenses/gpl-2.0.html>.
 #
 
+import argparse
 import asyncio
+import ctypes
+import gc
 import logging
+import os
+import statistics
+import time
+from array import array
 import uhid
 from at42qt1070_ft232_touchpad import AT42QT1070_FT232
+from bin5ring import EventRingWriter
 from keysw_ft232 import CodeTable, KeySw_FT232
 import signal
 import sys
@@ -29,10 +37,70 @@ import sys
 logger=logging.getLogger('uhidbin5')
 logger.setLevel(logging.INFO)
 
+class JitterStats():
+    NSAMPLES=10000
+    def __init__(self, label: str):
+        self.label=label
+        # pre-allocated, no allocation happens while sampling
+        self.scans=array('q', bytes(8*self.NSAMPLES))
+        self.nscan=0
+        self.lats=array('q', bytes(8*self.NSAMPLES))
+        self.nlat=0
+
+    def add_scan(self, dts: int) -> None:
+        self.scans[self.nscan%self.NSAMPLES]=dts
+        self.nscan+=1
+
+    def add_latency(self, lts: int) -> None:
+        self.lats[self.nlat%self.NSAMPLES]=lts
+        self.nlat+=1
+
+    def summary(self, name: str, samples: array, n: int, skip: int=0) -> None:
+        # 'skip' samples at the start are dropped, unless they are overwritten
+        vals=sorted(samples[skip:n] if n<=self.NSAMPLES else samples)
+        if len(vals)<2:
+            logger.info("%s: not enough samples" % name)
+            return
+        logger.info("%s: n=%d, mean=%.1f, stdev=%.1f, min=%.1f, p99=%.1f, max=%.1f (usec)" %
+                    (name, len(vals), statistics.mean(vals)/1E3, statistics.stdev(vals)/1E3,
+                     vals[0]/1E3, vals[int(len(vals)*0.99)]/1E3, vals[-1]/1E3))
+
+    def report(self) -> None:
+        logger.info("jitter report, %s mode" % self.label)
+        # the first scan interval includes the start up time
+        self.summary("scan interval", self.scans, self.nscan, 1)
+        self.summary("keypress to report", self.lats, self.nlat)
+
+def setup_realtime(cpu: int, priority: int) -> None:
+    try:
+        os.sched_setaffinity(0, {cpu})
+        logger.info("pinned to cpu %d" % cpu)
+    except OSError as e:
+        logger.warning("can't pin to cpu %d: %s" % (cpu, e))
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        logger.info("SCHED_FIFO priority=%d" % priority)
+    except OSError as e:
+        # no permission, or no realtime scheduler in the kernel
+        logger.warning("can't set SCHED_FIFO: %s, stay in the default scheduler" % e)
+    libc=ctypes.CDLL(None, use_errno=True)
+    MCL_CURRENT=1
+    MCL_FUTURE=2
+    if libc.mlockall(MCL_CURRENT|MCL_FUTURE)!=0:
+        logger.warning("mlockall failed: %s" % os.strerror(ctypes.get_errno()))
+    # all objects created in the start up go to the permanent generation,
+    # and make the young generation collection happen rarely
+    gc.collect()
+    gc.freeze()
+    gc.set_threshold(100000, 50, 100)
+
 class Bin5Uhid():
-    def __init__(self, device: uhid.UHIDDevice, mode: str='keysw'):
+    ZERO_REPORT=(0,0,0,0,0,0,0,0)
+    RECONNECT_MIN=0.1 # 100msec
+    RECONNECT_MAX=5.0 # 5sec
+    def __init__(self, device: uhid.UHIDDevice, mode: str='keysw', rawdetect: bool=False):
         if mode=='touchpad':
-            self.tdev=AT42QT1070_FT232()
+            self.tdev=AT42QT1070_FT232(rawdetect)
             logger.info("touchpad mode")
         elif mode=='keysw':
             self.tdev=KeySw_FT232()
@@ -44,13 +112,10 @@ class Bin5Uhid():
         self.device=device
         self.codetable=CodeTable()
         self.ready=(self.codetable.readconf()==0)
-        self.inkey=None
         self.modifiers={'RightGUI':(1<<7), 'RightAlt':(1<<6), 'RightShift':(1<<5),
                         'RightCtl':(1<<4), 'LeftGui':(1<<3), 'LeftAlt':(1<<2),
                         'LeftShift':(1<<1), 'LeftCtr':(1<<0)}
-
-    def scancode(self, rkey: str, mkey: str, mod: dict[str, int]) -> tuple[int, int]:
-        scodes={
+        self.scodes={
             '0':(0x27,0,0),
             'RET':(0x28,0,0),
             'ESC':(0x29,0,0),
@@ -83,6 +148,11 @@ class Bin5Uhid():
             'CLEFT':(0x50,self.modifiers['LeftCtr'],self.modifiers['LeftAlt']),
             'DOWN':(0x51,0,self.modifiers['LeftCtr']),
             'UP':(0x52,0,self.modifiers['LeftCtr']),
+            'C-a':(0x04,self.modifiers['LeftCtr'],0),
+            'C-c':(0x06,self.modifiers['LeftCtr'],0),
+            'C-f':(0x09,self.modifiers['LeftCtr'],0),
+            'C-v':(0x19,self.modifiers['LeftCtr'],0),
+            'C-x':(0x1b,self.modifiers['LeftCtr'],0),
             '!':(0x1e,self.modifiers['LeftShift'],0),
             '@':(0x1f,self.modifiers['LeftShift'],0),
             '#':(0x20,self.modifiers['LeftShift'],0),
@@ -105,7 +175,12 @@ class Bin5Uhid():
             '>':(0x37,self.modifiers['LeftShift'],0),
             '?':(0x38,self.modifiers['LeftShift'],0),
         }
+        self.reports={}
+        self.jitter=None
+        self.stats_interval=0
+        self.ring=None
 
+    def scancode(self, rkey: str, mkey: str, mod: dict[str, int]) -> tuple[int, int]:
         mbits=0
         if mod['M1']:
             mbits|=self.modifiers['LeftShift']
@@ -114,7 +189,10 @@ class Bin5Uhid():
         if mod['M5']:
             mbits|=self.modifiers['LeftCtr']
         if not mkey:
-            return (ord(rkey)-ord('a')+0x04, mbits);
+            if len(rkey)==1 and rkey>='a' and rkey<='z':
+                return (ord(rkey)-ord('a')+0x04, mbits);
+            # a table like NAV has non-letter keys in the 'key' column
+            mkey=rkey
         if len(mkey)==1 and mkey>='A' and mkey<='Z':
             if mod['M5']:
                 # when M5 table defines upper case letter, swich CTRL -> ALT
@@ -132,40 +210,89 @@ class Bin5Uhid():
             return (ord(mkey)-ord('1')+0x1e, mbits);
         if len(mkey)==1 and mkey>='a' and mkey<='z':
             return (ord(mkey)-ord('a')+0x04, mbits);
-        mbits|=scodes[mkey][1]
-        mbits&=~scodes[mkey][2]
-        return (scodes[mkey][0], mbits)
+        mbits|=self.scodes[mkey][1]
+        mbits&=~self.scodes[mkey][2]
+        return (self.scodes[mkey][0], mbits)
+
+    def keyreport(self, rkey: str, mkey: str, mod: dict[str, int]) -> tuple[int, ...]:
+        # reports are cached by the decoded keys and M1/M4/M5, which decide the scan code,
+        # no allocation happens for a chord which has been sent once
+        mkeys=self.reports.get(rkey)
+        if mkeys is None:
+            mkeys={}
+            self.reports[rkey]=mkeys
+        states=mkeys.get(mkey)
+        if states is None:
+            states=[None]*8
+            mkeys[mkey]=states
+        state=(1 if mod['M1'] else 0)|(2 if mod['M4'] else 0)|(4 if mod['M5'] else 0)
+        rep=states[state]
+        if rep is None:
+            scode,mbits=self.scancode(rkey, mkey, mod)
+            rep=(mbits,0,scode,0,0,0,0,0)
+            states[state]=rep
+        return rep
+
+    def publish(self, pkey: int, table: str, modifiers: dict[str, int],
+                report: tuple[int, ...]) -> None:
+        ts=time.time_ns()
+        self.ring.publish(ts, ts-self.tdev.press_ts, pkey, pkey&0x1f,
+                          table, modifiers, report)
+
+    async def recover(self, error: Exception) -> None:
+        # keep the uhid device, and re-probe the scanner with a bounded backoff
+        downts=time.time_ns()
+        logger.error("scan failed: %s" % error)
+        self.device.send_input(self.ZERO_REPORT)
+        backoff=self.RECONNECT_MIN
+        while True:
+            await asyncio.sleep(backoff)
+            ts=time.time_ns()
+            try:
+                if self.tdev.reconnect(): break
+            except Exception as e:
+                logger.debug("reconnect failed: %s" % e)
+            backoff=min(backoff*2, self.RECONNECT_MAX)
+        upts=time.time_ns()
+        logger.info("reconnected, downtime=%.1fsec, reconnect=%.1fmsec" %
+                    ((upts-downts)/1E9, (upts-ts)/1E6))
 
     async def get_tinput(self) -> None:
         while True:
-            pkey,change,repeat=self.tdev.scan_key()
+            try:
+                pkey,change,repeat=self.tdev.scan_key()
+            except Exception as e:
+                await self.recover(e)
+                return
+            if self.jitter and self.tdev.scan_target==self.tdev.SCAN_KEY_MIN_INTERVAL:
+                # intervals in the idle backoff are not jitter
+                self.jitter.add_scan(self.tdev.scan_dts)
+            if self.stats_interval and \
+               self.tdev.scan_ts-self.tdev.stats_ts>=self.stats_interval:
+                self.tdev.log_poll_stats()
             if not change: continue
             if pkey==0:
                 if repeat:
                     # get out from repeat status, send ZERO
-                    self.device.send_input((0,0,0,0,0,0,0,0))
+                    self.device.send_input(self.ZERO_REPORT)
                 return
+            # code2char may switch the table and clear the modifiers,
+            # the chord is published with the state it was decoded by
+            table=self.codetable.csel
             ik=self.codetable.code2char(pkey)
             if not ik[0]:
-                if not repeat: continue
-                mbits=0
-                dv=0
-                if self.codetable.modfier_status('M1'):
-                    mbits|=self.modifiers['LeftShift']
-                    dv=0xe1
-                if self.codetable.modfier_status('M4'):
-                    mbits|=self.modifiers['LeftAlt']
-                    dv=0xe2
-                if self.codetable.modfier_status('M5'):
-                    mbits|=self.modifiers['LeftCtr']
-                    dv=0xe0
+                if self.ring:
+                    self.publish(pkey, table, ik[2] if ik[2] is not None else
+                                 self.codetable.modifiers, self.ZERO_REPORT)
                 continue
-            self.inkey=self.scancode(ik[0], ik[1], ik[2])
+            rep=self.keyreport(ik[0], ik[1], ik[2])
             # new key pushed status, send the code
-            self.device.send_input((self.inkey[1],0,self.inkey[0],0,0,0,0,0))
+            self.device.send_input(rep)
+            if self.jitter: self.jitter.add_latency(time.time_ns()-self.tdev.press_ts)
+            if self.ring: self.publish(pkey, table, ik[2], rep)
             if repeat: return
             # non-repeat key event, pushed status is end, send ZERO
-            self.device.send_input((0,0,0,0,0,0,0,0))
+            self.device.send_input(self.ZERO_REPORT)
             return
 
     async def inject_input(self) -> None:
@@ -173,7 +300,7 @@ class Bin5Uhid():
             await self.get_tinput()
             while self.device._uhid._writer_registered: await asyncio.sleep(0)
 
-async def main():
+async def main(options) -> Bin5Uhid:
     device = uhid.UHIDDevice(
         0x15d9, 0x2323, 'binary5kbd', [
 	0x05, 0x01,	#/* USAGE_PAGE (Generic Desktop) */
@@ -213,10 +340,48 @@ async def main():
     )
     logging.getLogger(device.__class__.__name__).setLevel(logging.ERROR)
     await device.wait_for_start_asyncio()
-    mode = sys.argv[1] if len(sys.argv)>1 else 'keysw'
-    buhid=Bin5Uhid(device, mode)
+    buhid=Bin5Uhid(device, options.mode, options.rawdetect)
     if not buhid.ready: sys.exit(1)
+    if options.realtime:
+        # no idle backoff, always scan at the full rate
+        buhid.tdev.set_max_latency(buhid.tdev.SCAN_KEY_MIN_INTERVAL)
+    else:
+        buhid.tdev.set_max_latency(int(options.max_latency*1E6))
+    buhid.stats_interval=int(options.stats*1E9)
+    if options.events:
+        buhid.ring=EventRingWriter(options.events)
+    if options.jitter:
+        buhid.jitter=JitterStats('realtime' if options.realtime else 'normal')
+    if options.realtime:
+        setup_realtime(options.cpu, options.priority)
     asyncio.create_task(buhid.inject_input())
+    return buhid
+
+def parse_args():
+    pname=sys.argv[0]
+    i=pname.rfind('/')
+    if i>=0: pname=pname[i+1:]
+    opt_parser=argparse.ArgumentParser(prog=pname,
+                                       description="binary5 keyboard uhid device")
+    opt_parser.add_argument("mode", nargs='?', default="keysw",
+                            help="keytype 'keysw' or 'touchpad'")
+    opt_parser.add_argument("-d", "--rawdetect", action='store_true',
+                            help="touchpad detection by the raw signal deltas")
+    opt_parser.add_argument("-r", "--realtime", action='store_true',
+                            help="low-jitter mode, pin cpu, SCHED_FIFO, mlockall and freeze GC")
+    opt_parser.add_argument("-c", "--cpu", nargs='?', default=0, type=int,
+                            help="cpu number to pin in realtime mode")
+    opt_parser.add_argument("-p", "--priority", nargs='?', default=50, type=int,
+                            help="SCHED_FIFO priority in realtime mode")
+    opt_parser.add_argument("-l", "--max-latency", nargs='?', default=50, type=int,
+                            help="max scan interval in idle(msec), worst case first key latency")
+    opt_parser.add_argument("-s", "--stats", nargs='?', default=0, type=int,
+                            help="interval(sec) to log scan rate and cpu usage, 0:no log")
+    opt_parser.add_argument("-e", "--events", nargs='?', default=None,
+                            help="publish chord events to this shared memory ring file")
+    opt_parser.add_argument("-j", "--jitter", action='store_true',
+                            help="print scan interval and keypress to report jitter at exit")
+    return opt_parser.parse_args()
 
 def handler(signum, frame):
     global loop
@@ -224,7 +389,9 @@ def handler(signum, frame):
 
 if __name__ == '__main__':
     global loop
+    options=parse_args()
     signal.signal(signal.SIGINT, handler)
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())  # create device
+    buhid=loop.run_until_complete(main(options))  # create device
     loop.run_forever()  # run queued dispatch tasks
+    if buhid.jitter: buhid.jitter.report()